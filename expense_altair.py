@@ -0,0 +1,83 @@
+"""集計結果をブラウザで描画するグラフ（Altair / Vega-Lite）
+
+サーバーでは画像を描画せず、月次合計・ヒストグラムの度数・曜日別平均などの
+小さな集計表だけをブラウザへ送る。日本語の表示はブラウザのフォントで行うため、
+matplotlibやフォントの準備も不要になる。
+"""
+import altair as alt
+import pandas as pd
+
+from expense_core import CHART_TITLES, WEEKDAY_NAMES
+
+CHART_HEIGHT = 220
+CHART_COLORS = {'monthly': '#1976D2', 'histogram': '#43A047', 'weekday': '#FBC02D', 'category': '#8E24AA'}
+HIGHLIGHT_COLOR = '#E53935'
+
+def chart_data(kind, aggregates):
+    """グラフに送る集計表（行数は月数・ビン数・曜日数・分類数だけ）"""
+    if kind == 'monthly':
+        monthly = aggregates['monthly']
+        return pd.DataFrame({
+            '月': monthly.index.strftime('%Y-%m'),
+            '金額': monthly.to_numpy(),
+            '件数': aggregates['monthly_count'],
+        })
+    if kind == 'histogram':
+        counts, edges = aggregates['histogram']
+        return pd.DataFrame({'下限': edges[:-1], '上限': edges[1:], '件数': counts})
+    if kind == 'weekday':
+        weekday = aggregates['weekday']
+        return pd.DataFrame({
+            '曜日': WEEKDAY_NAMES,
+            '平均金額': weekday.to_numpy(),
+            '件数': aggregates['weekday_count'],
+        })
+    if kind == 'category':
+        categories = aggregates['categories']
+        return pd.DataFrame({
+            '分類': categories.index.astype(str),
+            '金額': categories['合計金額'].to_numpy(),
+            '件数': categories['件数'].to_numpy(),
+            '構成比': categories['構成比'].to_numpy(),
+        })
+    raise ValueError(f"未知のグラフ種類: {kind}")
+
+def altair_chart(kind, aggregates, selected_month=None):
+    """集計結果からAltairのグラフを作る（selected_monthの月は色を変えて表示）"""
+    data = chart_data(kind, aggregates)
+    color = alt.value(CHART_COLORS[kind])
+    base = alt.Chart(data, title=CHART_TITLES[kind], height=CHART_HEIGHT)
+    if kind == 'monthly':
+        if selected_month:
+            color = alt.condition(alt.datum['月'] == selected_month, alt.value(HIGHLIGHT_COLOR), color)
+        chart = base.mark_bar().encode(
+            x=alt.X('月:O', title=None, axis=alt.Axis(labelAngle=-45)),
+            y=alt.Y('金額:Q', title='金額'),
+            color=color,
+            tooltip=['月', alt.Tooltip('金額:Q', format=',.0f'), '件数'],
+        )
+    elif kind == 'histogram':
+        chart = base.mark_bar(opacity=0.75).encode(
+            x=alt.X('下限:Q', title='金額', bin='binned'),
+            x2='上限:Q',
+            y=alt.Y('件数:Q', title='件数'),
+            color=color,
+            tooltip=[alt.Tooltip('下限:Q', format=',.0f'), alt.Tooltip('上限:Q', format=',.0f'), '件数'],
+        )
+    elif kind == 'weekday':
+        chart = base.mark_bar().encode(
+            x=alt.X('曜日:N', title=None, sort=WEEKDAY_NAMES),
+            y=alt.Y('平均金額:Q', title='平均金額'),
+            color=color,
+            tooltip=['曜日', alt.Tooltip('平均金額:Q', format=',.0f'), '件数'],
+        )
+    elif kind == 'category':
+        chart = base.mark_bar().encode(
+            y=alt.Y('分類:N', title=None, sort=None),
+            x=alt.X('金額:Q', title='金額'),
+            color=color,
+            tooltip=['分類', alt.Tooltip('金額:Q', format=',.0f'), '件数', alt.Tooltip('構成比:Q', format='.1%')],
+        )
+    else:
+        raise ValueError(f"未知のグラフ種類: {kind}")
+    return chart
@@ -1,60 +1,25 @@
+# コールドスタート計測の起点になるため最初に読み込む
+from expense_trace import StageTimer, configure_logging, debug_enabled, profile_call, record_first_render
+import time
 import pandas as pd
 import streamlit as st
-import matplotlib.pyplot as plt
-import seaborn as sns
-import numpy as np
-import matplotlib as mpl
-import tempfile
 import os
-import re
-import matplotlib.font_manager as fm
-import urllib.request
-
-# --- 日本語フォント設定（IPAexGothicとNoto Sans CJK JPを自動DL＆優先適用） ---
-def get_japanese_font_paths():
-    font_paths = []
-    # IPAexGothic
-    ipaex_url = "https://github.com/googlefonts/ipafont/raw/main/fonts/ttf/ipaexg.ttf"
-    ipaex_path = os.path.join(tempfile.gettempdir(), "ipaexg.ttf")
-    if not os.path.exists(ipaex_path):
-        try:
-            urllib.request.urlretrieve(ipaex_url, ipaex_path)
-        except Exception:
-            pass
-    if os.path.exists(ipaex_path):
-        font_paths.append(ipaex_path)
-    # Noto Sans CJK JP
-    noto_url = "https://github.com/googlefonts/noto-cjk/raw/main/Sans/OTF/Japanese/NotoSansCJKjp-Regular.otf"
-    noto_path = os.path.join(tempfile.gettempdir(), "NotoSansCJKjp-Regular.otf")
-    if not os.path.exists(noto_path):
-        try:
-            urllib.request.urlretrieve(noto_url, noto_path)
-        except Exception:
-            pass
-    if os.path.exists(noto_path):
-        font_paths.append(noto_path)
-    return font_paths
+from expense_core import (
+    HEADER_PREVIEW_ROWS, MAX_HEADER_PREVIEW_ROWS, STREAMING_THRESHOLD_BYTES,
+    read_upload_bytes, content_digest, load_statements, statement_summary, header_candidates_text,
+    data_fingerprint, compute_aggregates, CHART_TITLES, available_charts, month_transactions,
+)
+from expense_categories import add_categories, budget_comparison
+from expense_detect import detect_findings, consult_prefill, advice_lines
+from expense_altair import altair_chart
+from expense_cache import dataset_cache
+from expense_store import STORE_PATH_ENV, TransactionStore
 
-font_paths = get_japanese_font_paths()
-font_names = []
-for path in font_paths:
-    try:
-        font_names.append(fm.FontProperties(fname=path).get_name())
-    except Exception:
-        pass
-# フォールバック英語フォントも追加
-font_names += ["Arial", "sans-serif"]
-plt.rcParams['font.family'] = font_names
-mpl.rcParams['axes.unicode_minus'] = False
+configure_logging()
 
-def get_fontproperties():
-    # 最初に見つかった日本語フォントを優先
-    for path in font_paths:
-        try:
-            return fm.FontProperties(fname=path)
-        except Exception:
-            continue
-    return fm.FontProperties()
+# グラフの描画方法: altair（ブラウザで描画、既定）または matplotlib（サーバーでPNGを描画）
+CHART_BACKEND_ENV = "EXPENSE_CHART_BACKEND"
+NO_MONTH = "（選択しない）"
 
 # --- ページ設定とカスタムCSS ---
 st.set_page_config(
@@ -142,89 +107,125 @@ body, .stApp {
 </style>
 """, unsafe_allow_html=True)
 
-def detect_header_row(df_preview):
-    """列名として最適な行を検出する"""
-    best_row = 0
-    max_score = 0
-    
-    for i, row in df_preview.iterrows():
-        score = 0
-        # 空白でないセル数をスコアに加算
-        score += row.notnull().sum()
-        
-        # 文字列型のセル数をスコアに加算
-        str_count = sum(isinstance(x, str) for x in row if pd.notnull(x))
-        score += str_count * 2
-        
-        # 日付っぽい文字列があれば加点
-        date_keywords = ['日付', 'date', 'DATE', '日', '年月日', '取引日', '日時', 'timestamp', '日付/時間']
-        if any(any(kw in str(x).lower() for kw in date_keywords) for x in row if pd.notnull(x)):
-            score += 3
-            
-        # 金額っぽい文字列があれば加点
-        amount_keywords = ['金額', '金', 'amount', 'AMOUNT', '円', '¥', '支出', '支払', '合計', 'total', 'price', '価格']
-        if any(any(kw in str(x).lower() for kw in amount_keywords) for x in row if pd.notnull(x)):
-            score += 3
-            
-        if score > max_score:
-            max_score = score
-            best_row = i
-            
-    return best_row
+# --- 解析結果のキャッシュ（プロセス全体で共有、内容ハッシュ・データの指紋をキーにする） ---
+def _load_statements(files, preview_rows, streaming):
+    df, results, duplicates = load_statements(files, preview_rows, streaming)
+    for r in results:
+        # 解析した時刻（キャッシュから返した結果を今回の計測と区別するため）
+        r['parsed_at'] = time.time()
+        # ファイルごとの取引表は結合済みの表と重複するため、列の構成だけ残す
+        if r['transactions'] is not None:
+            r['transactions'] = r['transactions'].head(0)
+    return df, results, duplicates
+
+def load_statements_cached(uploaded_files, preview_rows=HEADER_PREVIEW_ROWS, streaming=False):
+    """アップロードされた明細をまとめて読み込む（ファイル名と内容ハッシュでキャッシュ）"""
+    files = [(f.name, read_upload_bytes(f)) for f in uploaded_files]
+    keys = tuple((name, content_digest(data)) for name, data in files)
+    return dataset_cache.get_or_create(
+        ('statements', keys, preview_rows, streaming), lambda: _load_statements(files, preview_rows, streaming)
+    )
+
+def _analyze(df):
+    # 摘要からの分類もここで付ける（指紋に摘要を含むので同じデータなら再分類しない）
+    transactions = add_categories(df)
+    return {
+        'transactions': transactions,
+        'aggregates': compute_aggregates(transactions),
+        'findings': detect_findings(transactions),
+    }
+
+def analyze_cached(df):
+    """(指紋, 解析結果) を返す。解析結果は分類付きの取引表・集計・検出結果のdict"""
+    fingerprint = data_fingerprint(df)
+    return fingerprint, dataset_cache.get_or_create(('analysis', fingerprint), lambda: _analyze(df))
 
-def find_date_and_amount_columns(df):
-    """日付と金額の列を探す（より広い範囲で検索）"""
-    date_col = None
-    amount_col = None
-    
-    # 列名の直接検索
-    for col in df.columns:
-        col_str = str(col).lower()
-        if any(k in col_str for k in ['日付', 'date', '日', '年月日', '取引日', '日時', 'timestamp', '日付/時間']):
-            date_col = col
-        elif any(k in col_str for k in ['金額', '金', 'amount', '円', '¥', '支出', '支払', '合計', 'total', 'price', '価格']):
-            amount_col = col
-    
-    # 列名で見つからない場合、データの内容で検索
-    if not (date_col and amount_col):
-        for col in df.columns:
-            # 最初の100行のデータを確認
-            sample_data = df[col].head(100).astype(str)
-            
-            # 日付っぽいデータを探す
-            if not date_col:
-                date_patterns = [
-                    r'\d{4}[-/]\d{1,2}[-/]\d{1,2}',  # YYYY-MM-DD
-                    r'\d{1,2}[-/]\d{1,2}[-/]\d{4}',  # DD-MM-YYYY
-                    r'\d{4}年\d{1,2}月\d{1,2}日',     # 日本語形式
-                ]
-                if any(any(re.search(pattern, str(x)) for x in sample_data) for pattern in date_patterns):
-                    date_col = col
-            
-            # 金額っぽいデータを探す
-            if not amount_col:
-                amount_patterns = [
-                    r'[¥￥]?\d+[,\d]*円?',  # 日本円
-                    r'\d+[,\d]*\.?\d*',     # 数値
-                ]
-                if any(any(re.search(pattern, str(x)) for x in sample_data) for pattern in amount_patterns):
-                    amount_col = col
-    
-    return date_col, amount_col
+def cached_analysis(handle):
+    """セッションが持つハンドル（指紋）から解析結果を取り出す（追い出し済みならNone）"""
+    return dataset_cache.get(('analysis', handle)) if handle else None
 
-def read_excel_with_auto_header(uploaded_file):
-    """Excelファイルを読み込み、最適なヘッダー行を自動検出"""
-    # 先頭20行を仮読み込み（検索範囲を拡大）
-    df_preview = pd.read_excel(uploaded_file, header=None, nrows=20)
-    
-    # 最適なヘッダー行を検出
-    header_row = detect_header_row(df_preview)
-    
-    # 検出したヘッダー行を使用して全体を読み込み
-    df = pd.read_excel(uploaded_file, header=header_row)
-    
+# --- 取引履歴ストア（環境変数 EXPENSE_STORE_PATH を設定した場合のみ有効） ---
+@st.experimental_singleton
+def _transaction_store(path):
+    return TransactionStore(path)
+
+def open_store():
+    """履歴ストアを返す（未設定ならNone）"""
+    path = os.environ.get(STORE_PATH_ENV)
+    return _transaction_store(path) if path else None
+
+def select_history(store, timer):
+    """表示期間を選び、その期間の取引だけをストアから取り出す"""
+    first, last = (t.date() for t in store.date_bounds())
+    period = st.date_input("表示期間", value=(first, last), min_value=first, max_value=last)
+    # 期間の終わりを選択中は開始日だけが返る
+    start, end = period if isinstance(period, (tuple, list)) and len(period) == 2 else (first, last)
+    with timer.stage('store_query') as fields:
+        df = store.query(start, pd.Timestamp(end) + pd.Timedelta(days=1))
+        fields['rows'] = len(df)
     return df
 
+# --- 分析結果の表示 ---
+def show_analysis(df, timer):
+    """グラフと基本統計量を表示（表示できた場合True）"""
+    if len(df) == 0:
+        st.info("選択した期間の取引はありません。")
+        return False
+    # --- グラフを一画面に表示（余白最小化） ---
+    st.markdown('<div style="display: flex; flex-direction: column; gap: 0.5rem;">', unsafe_allow_html=True)
+    with timer.stage('analyze', rows=len(df)):
+        fingerprint, analysis = analyze_cached(df)
+    aggregates = analysis['aggregates']
+    # セッションには解析結果の実体ではなくハンドルだけを持たせる（相談ページで使う）
+    st.session_state['dataset'] = fingerprint
+    backend = os.environ.get(CHART_BACKEND_ENV, 'altair')
+    selected_month = None
+    for kind in available_charts(aggregates):
+        title = CHART_TITLES[kind]
+        try:
+            st.subheader(title)
+            if kind == 'monthly':
+                # 月を選ぶと、その月の取引を集計時の索引で取り出して表示する
+                months = aggregates['monthly'].index.strftime('%Y-%m').tolist()
+                selected = st.selectbox("月を選んで取引を表示", [NO_MONTH] + months[::-1])
+                selected_month = None if selected == NO_MONTH else selected
+            if backend == 'matplotlib':
+                from expense_charts import chart_png
+                with timer.stage('chart_png', kind=kind):
+                    png = chart_png(kind, fingerprint, aggregates)
+                with timer.stage('st_image', kind=kind, bytes=len(png)):
+                    st.image(png, use_column_width=True)
+            else:
+                with timer.stage('altair_chart', kind=kind):
+                    st.altair_chart(altair_chart(kind, aggregates, selected_month), use_container_width=True)
+            record_first_render()
+            if kind == 'monthly' and selected_month:
+                with timer.stage('month_transactions', month=selected_month):
+                    month_df = month_transactions(analysis['transactions'], aggregates, selected_month)
+                st.write(f"{selected_month}の取引（{len(month_df)}件・合計¥{month_df['金額'].sum():,.0f}）")
+                st.dataframe(month_df.sort_values('日付').reset_index(drop=True))
+        except Exception as e:
+            st.error(f"{title}グラフの描画でエラー: {e}")
+    st.markdown('</div>', unsafe_allow_html=True)
+    # --- 基本統計量 ---
+    st.subheader("支出の基本統計量")
+    st.dataframe(aggregates['stats'].to_frame())
+    if 'categories' in aggregates:
+        # --- 分類別の集計（支出分類表の月予算と比較） ---
+        st.subheader("分類別の支出と月予算")
+        st.dataframe(budget_comparison(aggregates['categories']).style.format({
+            '合計金額': '{:,.0f}', '構成比': '{:.1%}', '月平均': '{:,.0f}', '月予算': '{:,.0f}', '予算差': '{:+,.0f}',
+        }, na_rep='-'))
+    # --- 定期的な支出・高額支出（相談ページの下書きにも使う） ---
+    findings = analysis['findings']
+    if len(findings['recurring']):
+        st.subheader("定期的な支出")
+        st.dataframe(findings['recurring'])
+    if len(findings['outliers']):
+        st.subheader("通常より大きい支出")
+        st.dataframe(findings['outliers'])
+    return True
+
 # --- ページ遷移用ヘルパー ---
 def get_page():
     query = st.experimental_get_query_params()
@@ -233,7 +234,36 @@ def get_page():
 def set_page(page_name):
     st.experimental_set_query_params(page=page_name)
 
+def _query_flag(name):
+    return st.experimental_get_query_params().get(name, [''])[0] in ('1', 'true')
+
+def show_debug_panel(timer, summary, profile_report=None):
+    """段階ごとの計測結果とプロファイルを表示する（EXPENSE_DEBUG=1 または ?debug=1 のとき）"""
+    with st.expander("処理時間の内訳（デバッグ）", expanded=profile_report is not None):
+        st.write(f"リクエスト {summary['request']}: 合計 {summary['seconds']:.3f}秒")
+        st.write("解析結果キャッシュ", summary['cache'])
+        if timer.records:
+            st.dataframe(pd.DataFrame(timer.records))
+        if st.checkbox("次の実行をcProfileで計測する", key="profile_next"):
+            st.caption("設定を変えるか再実行すると、その1回だけを計測します。")
+        if profile_report:
+            st.text(profile_report)
+
 def main():
+    timer = StageTimer()
+    debug = debug_enabled() or _query_flag('debug')
+    profile_report = None
+    if debug and st.session_state.get('profile_next'):
+        # 1回だけ計測する（チェックは次の実行に持ち越さない）
+        st.session_state['profile_next'] = False
+        _, profile_report = profile_call(show_page, timer)
+    else:
+        show_page(timer)
+    summary = timer.finish(page=get_page(), profiled=profile_report is not None, cache=dataset_cache.stats())
+    if debug:
+        show_debug_panel(timer, summary, profile_report)
+
+def show_page(timer):
     page = get_page()
     if page == "main":
         st.markdown('<h1 class="main-title">💰 支出分析・<br>削減提案システム</h1>', unsafe_allow_html=True)
@@ -247,99 +277,84 @@ def main():
         </div>
         """, unsafe_allow_html=True)
         st.markdown('<div style="margin: 1.2rem 0;">', unsafe_allow_html=True)
-        uploaded_file = st.file_uploader("Excelファイルをアップロードしてください", type=["xlsx", "xls"])
+        uploaded_files = st.file_uploader("Excelファイルをアップロードしてください（複数選択可）", type=["xlsx", "xls"], accept_multiple_files=True)
         st.markdown('</div>', unsafe_allow_html=True)
         ai_button_visible = False
-        if uploaded_file:
+        store = open_store()
+        if uploaded_files:
+            # 大きな.xlsxは必要な列だけを逐次読み込む
+            xlsx_files = [f for f in uploaded_files if f.name.lower().endswith('.xlsx')]
+            use_streaming = st.checkbox(
+                "省メモリ読み込み（大容量ファイル向け）",
+                value=any(f.size >= STREAMING_THRESHOLD_BYTES for f in xlsx_files),
+                disabled=not xlsx_files,
+                help="日付・金額・摘要の列だけを保持して読み込みます（.xlsxのみ）"
+            )
+            # 前置きの長い銀行明細向けにヘッダー検索範囲を広げられるようにする
+            preview_rows = st.number_input(
+                "ヘッダー行の検索範囲（先頭から何行）",
+                min_value=1, max_value=MAX_HEADER_PREVIEW_ROWS, value=HEADER_PREVIEW_ROWS, step=10
+            )
+            # 読み込み後に、ファイルごとのヘッダー行の候補を検索範囲の入力欄の下に表示する
+            header_note = st.empty()
             try:
-                df = read_excel_with_auto_header(uploaded_file)
-                st.success(f"データ読み込み完了！{len(df)}件のデータを処理しました。")
+                with timer.stage('load_statements', files=len(uploaded_files), streaming=use_streaming) as fields:
+                    df, results, duplicates = load_statements_cached(uploaded_files, int(preview_rows), use_streaming)
+                    fields['rows'] = len(df)
+                header_lines = [f"{r['name']}: {text}" for r in results for text in [header_candidates_text(r)] if text]
+                if header_lines:
+                    header_note.caption("  \n".join(["ヘッダー行の候補"] + header_lines))
+                for r in results:
+                    # 今回解析したファイルだけ、解析時の段階ごとの秒数を記録する
+                    if r.get('parsed_at', 0) >= timer.started_at:
+                        for stage, seconds in r['timings'].items():
+                            timer.add(stage, seconds, file=r['name'], rows=r['rows'])
+                loaded = [r for r in results if r['transactions'] is not None]
+                if len(results) > 1:
+                    st.success(f"データ読み込み完了！{len(loaded)}/{len(results)}ファイル・{len(df)}件のデータを処理しました。")
+                else:
+                    st.success(f"データ読み込み完了！{len(df)}件のデータを処理しました。")
                 with st.expander("検出された列名", expanded=False):
-                    st.write(df.columns.tolist())
+                    st.dataframe(statement_summary(results))
+                for r in results:
+                    if r['error']:
+                        st.error(f"{r['name']}: エラーが発生しました: {r['error']}")
+                    elif r['transactions'] is None and loaded:
+                        st.warning(f"{r['name']}: 日付や金額の列が見つからなかったため除外しました。")
                 st.markdown('<h2 class="sub-title">📊 支出データの可視化</h2>', unsafe_allow_html=True)
-                date_col, amount_col = find_date_and_amount_columns(df)
-                if date_col and amount_col:
-                    df = df[[date_col, amount_col]].dropna()
-                    df.columns = ['日付', '金額']
-                    try:
-                        df['日付'] = pd.to_datetime(df['日付'], errors='coerce')
-                    except:
-                        df['日付'] = pd.to_datetime(df['日付'].astype(str).str.replace('年', '-').str.replace('月', '-').str.replace('日', ''), errors='coerce')
-                    try:
-                        df['金額'] = pd.to_numeric(df['金額'].astype(str).str.replace('¥', '').str.replace('￥', '').str.replace(',', '').str.replace('円', ''), errors='coerce')
-                    except:
-                        df['金額'] = pd.to_numeric(df['金額'], errors='coerce')
-                    df = df.dropna()
+                if loaded:
+                    dropped = sum(r['dropped'] for r in loaded)
+                    if dropped:
+                        st.warning(f"{dropped}件の行は日付または金額を解釈できなかったため除外しました。")
+                    if duplicates:
+                        st.info(f"複数のファイルで重複していた{duplicates}件の取引を除外しました。")
                     if len(df) == 0:
                         st.error("有効なデータが見つかりませんでした。データの形式を確認してください。")
                         return
-                    # --- グラフを一画面に表示（余白最小化） ---
-                    st.markdown('<div style="display: flex; flex-direction: column; gap: 0.5rem;">', unsafe_allow_html=True)
-                    # 月次支出の推移
-                    try:
-                        st.subheader("月次支出の推移")
-                        fp = get_fontproperties()
-                        fig1, ax1 = plt.subplots(figsize=(6, 2.5))
-                        monthly = df.groupby(df['日付'].dt.strftime('%Y-%m'))['金額'].sum()
-                        monthly.plot(kind='bar', ax=ax1, color="#1976D2")
-                        ax1.set_title('月次支出の推移', fontsize=13, fontproperties=fp)
-                        ax1.set_xlabel('', fontproperties=fp)
-                        ax1.set_ylabel('金額', fontproperties=fp)
-                        plt.xticks(rotation=45, fontsize=9, fontproperties=fp)
-                        plt.yticks(fontsize=9, fontproperties=fp)
-                        plt.tight_layout()
-                        st.pyplot(fig1)
-                        plt.close(fig1)
-                    except Exception as e:
-                        st.error(f"月次支出の推移グラフの描画でエラー: {e}")
-                    # 日次支出の分布
-                    try:
-                        st.subheader("日次支出の分布")
-                        fp = get_fontproperties()
-                        fig2, ax2 = plt.subplots(figsize=(6, 2.5))
-                        sns.histplot(df['金額'], bins=30, ax=ax2, color="#43A047")
-                        ax2.set_title('日次支出の分布', fontsize=13, fontproperties=fp)
-                        ax2.set_xlabel('金額', fontproperties=fp)
-                        ax2.set_ylabel('件数', fontproperties=fp)
-                        plt.xticks(fontsize=9, fontproperties=fp)
-                        plt.yticks(fontsize=9, fontproperties=fp)
-                        plt.tight_layout()
-                        st.pyplot(fig2)
-                        plt.close(fig2)
-                    except Exception as e:
-                        st.error(f"日次支出の分布グラフの描画でエラー: {e}")
-                    # 曜日別の平均支出
-                    try:
-                        st.subheader("曜日別の平均支出")
-                        fp = get_fontproperties()
-                        fig3, ax3 = plt.subplots(figsize=(6, 2.5))
-                        df['曜日'] = df['日付'].dt.day_name()
-                        weekday = df.groupby('曜日')['金額'].mean().reindex(
-                            ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday'])
-                        weekday.plot(kind='bar', ax=ax3, color="#FBC02D")
-                        ax3.set_title('曜日別の平均支出', fontsize=13, fontproperties=fp)
-                        ax3.set_xlabel('', fontproperties=fp)
-                        ax3.set_ylabel('平均金額', fontproperties=fp)
-                        plt.xticks(fontsize=9, fontproperties=fp)
-                        plt.yticks(fontsize=9, fontproperties=fp)
-                        plt.tight_layout()
-                        st.pyplot(fig3)
-                        plt.close(fig3)
-                    except Exception as e:
-                        st.error(f"曜日別の平均支出グラフの描画でエラー: {e}")
-                    st.markdown('</div>', unsafe_allow_html=True)
-                    # --- 基本統計量 ---
-                    st.subheader("支出の基本統計量")
-                    st.dataframe(df['金額'].describe().to_frame())
-                    ai_button_visible = True
+                    if store is not None:
+                        # 同じアップロードを再実行のたびに書き込まないよう、データの指紋ごとに1回だけ追加
+                        stored = st.session_state.setdefault('stored_uploads', {})
+                        fingerprint = data_fingerprint(df)
+                        if fingerprint not in stored:
+                            with timer.stage('store_append', rows=len(df)):
+                                stored[fingerprint] = store.append(df)
+                        st.info(f"履歴に新しい取引{stored[fingerprint]}件を保存しました（保存済み合計{store.count()}件）。")
+                        df = select_history(store, timer)
+                    ai_button_visible = show_analysis(df, timer)
                 else:
                     st.error("日付や金額の列が見つかりませんでした。Excelの列名を確認してください。")
-                    with st.expander("検出された列名", expanded=False):
-                        st.write(df.columns.tolist())
-                    st.write("データの最初の5行:", df.head())
+                    for r in results:
+                        if r['head'] is not None:
+                            with st.expander(f"{r['name']} の列名", expanded=False):
+                                st.write(r['columns'])
+                            st.write(f"{r['name']} の最初の5行:", r['head'])
             except Exception as e:
                 st.error(f"エラーが発生しました: {str(e)}")
                 st.write("ファイルの形式や内容を確認してください。")
+        elif store is not None and store.date_bounds() is not None:
+            # アップロードがなくても保存済みの履歴を表示する
+            st.markdown('<h2 class="sub-title">📊 保存済みの支出履歴</h2>', unsafe_allow_html=True)
+            ai_button_visible = show_analysis(select_history(store, timer), timer)
         # AIと相談ボタンはグラフ表示後のみ
         if ai_button_visible:
             st.markdown("<div style='text-align:center; margin-top:2rem;'>", unsafe_allow_html=True)
@@ -352,11 +367,32 @@ def main():
         st.markdown('<h2 class="sub-title">あなたの支出について教えてください</h2>', unsafe_allow_html=True)
         if 'advice_submitted' not in st.session_state:
             st.session_state['advice_submitted'] = False
+        # 分析結果から検出した支出を示し、回答の下書きにする
+        analysis = cached_analysis(st.session_state.get('dataset'))
+        if st.session_state.get('dataset') and analysis is None:
+            st.info("分析結果の保持期間が過ぎました。検出結果を使うには、もう一度ファイルを読み込んでください。")
+        findings = analysis['findings'] if analysis else None
+        prefill = consult_prefill(findings) if findings else {}
+        if analysis:
+            stats = analysis['aggregates']['stats']
+            monthly = analysis['aggregates']['monthly']
+            cols = st.columns(3)
+            cols[0].metric("分析した取引", f"{int(stats['count']):,}件")
+            cols[1].metric("月平均の支出", f"¥{monthly.mean():,.0f}")
+            cols[2].metric("最大の支出", f"¥{stats['max']:,.0f}")
+        if findings and (len(findings['recurring']) or len(findings['outliers'])):
+            with st.expander("分析結果から検出した支出", expanded=True):
+                if len(findings['outliers']):
+                    st.write("通常より大きい支出")
+                    st.dataframe(findings['outliers'])
+                if len(findings['recurring']):
+                    st.write("定期的な支出")
+                    st.dataframe(findings['recurring'])
         with st.form("user_input_form"):
-            high_expense_purpose = st.text_input("高額支出は主にどのような用途でしたか？", value=st.session_state.get('high_expense_purpose', ''))
+            high_expense_purpose = st.text_input("高額支出は主にどのような用途でしたか？", value=st.session_state.get('high_expense_purpose', prefill.get('high_expense_purpose', '')))
             high_expense_necessity = st.text_input("これらの支出は必要不可欠なものですか？", value=st.session_state.get('high_expense_necessity', ''))
             high_expense_future = st.text_input("今後同様の支出を予定していますか？", value=st.session_state.get('high_expense_future', ''))
-            current_concerns = st.text_input("現在、特に気になっている支出項目はありますか？", value=st.session_state.get('current_concerns', ''))
+            current_concerns = st.text_input("現在、特に気になっている支出項目はありますか？", value=st.session_state.get('current_concerns', prefill.get('current_concerns', '')))
             future_goals = st.text_input("今後、支出を増やしたい（または減らしたい）項目はありますか？", value=st.session_state.get('future_goals', ''))
             saving_goal = st.text_input("具体的な節約目標はありますか？（例：月額で¥10,000削減したいなど）", value=st.session_state.get('saving_goal', ''))
             lifestyle_improvements = st.text_input("現在の支出で、特に改善したい生活習慣はありますか？", value=st.session_state.get('lifestyle_improvements', ''))
@@ -385,6 +421,8 @@ def main():
             }
             st.table(pd.DataFrame(table.items(), columns=["項目", "内容"]))
             st.markdown("### アドバイス")
+            for line in (advice_lines(findings) if findings else []):
+                st.write(f"・{line}")
             if st.session_state.get('high_expense_necessity', '') and ('必要' in st.session_state.get('high_expense_necessity', '') or '必須' in st.session_state.get('high_expense_necessity', '')):
                 st.write(f"・{st.session_state.get('high_expense_purpose', '')}に関する支出は必要不可欠とのことですが、以下のような代替案を検討してみてはいかがでしょうか：")
                 st.write("- まとめ買いによる割引の活用\n- ポイントカードやクレジットカードの特典の活用\n- 季節や時期を考慮した購入タイミングの調整")
@@ -0,0 +1,178 @@
+"""支出明細の一括処理CLI（Streamlitを使わずに解析パイプラインを実行する）
+
+使い方:
+    python expense_batch.py 明細のディレクトリ -o 出力ディレクトリ [--format csv|parquet] [--charts]
+
+出力:
+    files.<形式>                       ファイルごとの検出結果（列名・件数・エラー）
+    per_file/<ファイル名>_<表>.<形式>    ファイルごとの月次・曜日別・基本統計量・定期的な支出（recurring）・
+                                       高額支出（outliers）、摘要があれば分類別も
+    combined_<表>.<形式>               全ファイルを結合（ファイル間の重複を除外）した集計
+    combined_transactions.<形式>       結合した取引一覧（摘要があれば分類付き）
+    charts/<ファイル名>_<種類>.png      --charts 指定時のグラフ画像
+
+--store を指定すると、結合した取引を履歴ストア（SQLite）に追加する（保存済みの取引は無視）。
+"""
+import argparse
+import concurrent.futures
+import importlib.util
+import logging
+import os
+import sys
+import time
+
+from expense_categories import add_categories
+from expense_detect import detect_findings
+from expense_core import (
+    HEADER_PREVIEW_ROWS, PARSE_WORKERS,
+    load_statement, merge_statements, statement_summary, compute_aggregates, summary_tables,
+)
+from expense_store import STORE_PATH_ENV, TransactionStore
+from expense_trace import StageTimer
+
+logger = logging.getLogger(__name__)
+
+STATEMENT_SUFFIXES = ('.xlsx', '.xls')
+OUTPUT_FORMATS = ('csv', 'parquet')
+# pandasのto_parquetが使えるエンジン
+PARQUET_ENGINES = ('pyarrow', 'fastparquet')
+
+def find_statements(directory, recursive=False):
+    """ディレクトリ内の明細ファイル（Excelの一時ファイルを除く）をパス順で返す"""
+    paths = []
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith(STATEMENT_SUFFIXES) and not name.startswith('~$'):
+                paths.append(os.path.join(root, name))
+        if not recursive:
+            break
+    return paths
+
+def parquet_engine_available():
+    return any(importlib.util.find_spec(engine) is not None for engine in PARQUET_ENGINES)
+
+def write_table(df, path, fmt):
+    """表をCSV（Excelで開けるようBOM付きUTF-8）またはParquetで保存"""
+    if fmt == 'parquet':
+        df.to_parquet(f"{path}.parquet", index=False)
+    else:
+        df.to_csv(f"{path}.csv", index=False, encoding='utf-8-sig')
+
+def write_summary(transactions, output_dir, prefix, fmt, charts_dir=None):
+    """取引表を集計して、月次・曜日別・基本統計量・分類別・定期的な支出・高額支出の表（とグラフ）を書き出す"""
+    os.makedirs(output_dir, exist_ok=True)
+    transactions = add_categories(transactions)
+    aggregates = compute_aggregates(transactions)
+    tables = {**summary_tables(aggregates), **detect_findings(transactions)}
+    for name, table in tables.items():
+        write_table(table, os.path.join(output_dir, f"{prefix}_{name}"), fmt)
+    if charts_dir:
+        # グラフを使う場合だけmatplotlibとフォントを読み込む
+        from expense_charts import available_charts, render_chart
+        os.makedirs(charts_dir, exist_ok=True)
+        for kind in available_charts(aggregates):
+            with open(os.path.join(charts_dir, f"{prefix}_{kind}.png"), 'wb') as f:
+                f.write(render_chart(kind, aggregates))
+
+def _output_prefix(name):
+    # サブディレクトリ内の同名ファイルが衝突しないよう相対パスを平坦化する
+    return os.path.splitext(name)[0].replace(os.sep, '__')
+
+def process_file(job):
+    """1ファイルを解析し、ファイルごとの集計を書き出す（ワーカープロセスで実行）"""
+    path, name, output_dir, preview_rows, streaming, fmt, charts = job
+    started = time.perf_counter()
+    with open(path, 'rb') as f:
+        data = f.read()
+    result = load_statement(name, data, preview_rows, streaming)
+    transactions = result['transactions']
+    if transactions is not None and len(transactions):
+        try:
+            write_summary(
+                transactions, os.path.join(output_dir, 'per_file'), _output_prefix(name), fmt,
+                os.path.join(output_dir, 'charts') if charts else None,
+            )
+        except Exception as e:
+            result['error'] = f"出力に失敗しました: {e}"
+    # 親プロセスへ返すのは取引表と検出結果だけにする
+    result['head'] = None
+    result['seconds'] = time.perf_counter() - started
+    return result
+
+def run(input_dir, output_dir, fmt='csv', charts=False, workers=None,
+        preview_rows=HEADER_PREVIEW_ROWS, streaming=False, recursive=False, store_path=None):
+    """ディレクトリ内の明細をワーカープールで処理し、ファイルごと・全体の集計を書き出す
+
+    戻り値は (ファイルごとの結果のリスト, 重複として除外した件数)。
+    """
+    timer = StageTimer()
+    paths = find_statements(input_dir, recursive)
+    os.makedirs(output_dir, exist_ok=True)
+    jobs = [
+        (path, os.path.relpath(path, input_dir), output_dir, preview_rows, streaming, fmt, charts)
+        for path in paths
+    ]
+    workers = min(len(jobs), workers or PARSE_WORKERS)
+    if workers > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(process_file, jobs))
+    else:
+        results = [process_file(job) for job in jobs]
+    for r in results:
+        if r['error']:
+            logger.error("%s: %s", r['name'], r['error'])
+        elif r['transactions'] is None:
+            logger.warning("%s: 日付や金額の列が見つかりませんでした", r['name'])
+        else:
+            logger.info("%s: %d件 (%.2fs)", r['name'], len(r['transactions']), r['seconds'])
+        for stage, seconds in r['timings'].items():
+            timer.add(stage, seconds, file=r['name'], rows=r['rows'])
+
+    write_table(statement_summary(results), os.path.join(output_dir, 'files'), fmt)
+    with timer.stage('merge_statements'):
+        merged, duplicates = merge_statements([r['transactions'] for r in results if r['transactions'] is not None])
+    if len(merged):
+        with timer.stage('write_combined', rows=len(merged)):
+            merged = add_categories(merged)
+            write_summary(merged, output_dir, 'combined', fmt, os.path.join(output_dir, 'charts') if charts else None)
+            write_table(merged, os.path.join(output_dir, 'combined_transactions'), fmt)
+        if store_path:
+            with timer.stage('store_append', rows=len(merged)):
+                added = TransactionStore(store_path).append(merged)
+            logger.info("履歴ストアに%d件を追加しました: %s", added, store_path)
+    timer.finish(files=len(results), duplicates=duplicates)
+    return results, duplicates
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="支出明細（Excel）を一括で解析して集計を書き出す")
+    parser.add_argument("input_dir", help="明細ファイル（.xlsx/.xls）のディレクトリ")
+    parser.add_argument("-o", "--output", default="output", help="出力ディレクトリ（既定: output）")
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, default="csv", help="出力形式")
+    parser.add_argument("--charts", action="store_true", help="グラフ画像（PNG）も出力する")
+    parser.add_argument("--workers", type=int, default=None, help="並列プロセス数（既定: CPUコア数）")
+    parser.add_argument("--preview-rows", type=int, default=HEADER_PREVIEW_ROWS, help="ヘッダー行の検索範囲")
+    parser.add_argument("--streaming", action="store_true", help="省メモリ読み込みを使う（.xlsxのみ）")
+    parser.add_argument("--recursive", action="store_true", help="サブディレクトリも対象にする")
+    parser.add_argument("--store", default=os.environ.get(STORE_PATH_ENV), help="取引を追加する履歴ストア（SQLite）のパス")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    if not os.path.isdir(args.input_dir):
+        parser.error(f"ディレクトリが見つかりません: {args.input_dir}")
+    if args.format == 'parquet' and not parquet_engine_available():
+        parser.error("Parquet形式で出力するには pyarrow（または fastparquet）をインストールしてください")
+    started = time.perf_counter()
+    results, duplicates = run(
+        args.input_dir, args.output, args.format, args.charts, args.workers,
+        args.preview_rows, args.streaming, args.recursive, args.store,
+    )
+    if not results:
+        logger.error("明細ファイルが見つかりませんでした: %s", args.input_dir)
+        return 1
+    loaded = sum(r['transactions'] is not None for r in results)
+    logger.info("%d/%dファイルを処理、重複除外%d件 (%.2fs)", loaded, len(results), duplicates, time.perf_counter() - started)
+    return 1 if any(r['error'] for r in results) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
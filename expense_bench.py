@@ -0,0 +1,268 @@
+"""解析パイプラインのベンチマーク（合成した明細で段階ごとの処理時間を計測する）
+
+使い方:
+    python expense_bench.py [--sizes 100,10000,100000] [--layouts plain,preamble,...] [-o bench.json]
+    python expense_bench.py --compare 基準.json 比較対象.json [--threshold 1.25]
+
+合成する明細の形式（--layouts）:
+    plain      1行目がヘッダー、日付はExcelの日付型、金額は数値
+    preamble   ヘッダーの前に口座情報などの前置き行、日付は「2024/01/05」、金額は「1,234円」
+    english    英語のヘッダー（Date/Description/Amount）、ISO形式の日付
+    fullwidth  和暦の日付（令和6年1月5日）と全角数字の金額（１，２３４）
+    wide       40列の横に広いシート（番号・コード・メモなどの列に日付・金額・摘要が混ざる）
+    footer     plainの最後に日付・金額が空の「以上」の行（件数が読み込みの区切りの倍数だと最後の区切りは欠損値だけになる）
+
+計測の前に、欠損値だけの列の正規化と、通常の読み込み・省メモリ読み込みの件数の一致を確認する（失敗すると例外）。
+計測結果はJSONで書き出し、--compare でコミット間の結果を比べる（閾値を超えて遅くなった段階があれば終了コード1）。
+生成した.xlsxは --cache-dir に保存して次回から使い回す。
+"""
+import argparse
+import datetime
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import openpyxl
+import pandas as pd
+
+from expense_categories import add_categories
+from expense_core import (
+    HEADER_PREVIEW_ROWS,
+    read_excel_with_auto_header, detect_header_row, find_columns, find_date_and_amount_columns,
+    normalize_amounts, normalize_dates, normalize_descriptions,
+    normalize_transactions, read_excel_streaming, compute_aggregates,
+)
+from expense_detect import detect_findings
+
+LAYOUTS = ('plain', 'preamble', 'english', 'fullwidth', 'wide', 'footer')
+DEFAULT_SIZES = (100, 10000, 100000)
+PAYEES = ['ｲｵﾝ 新宿店', 'スターバックス 渋谷', '東京電力', 'ダイソー', 'NETFLIX.COM', 'ﾗｰﾒﾝ 一蘭', 'AMAZON.CO.JP', '家賃']
+FULLWIDTH_DIGITS = str.maketrans('0123456789,', '０１２３４５６７８９，')
+WIDE_COLUMNS = 40
+COMPARE_THRESHOLD = 1.25
+# これより短い段階は誤差が大きいため比較しない
+COMPARE_MIN_SECONDS = 0.005
+
+# --- 明細の合成 ---
+def _era_date(d):
+    return f"令和{d.year - 2018}年{d.month}月{d.day}日"
+
+def _columns(layout, rows, rng):
+    """形式ごとの (前置き行, ヘッダー, 列の値のリスト) を作る"""
+    dates = pd.Timestamp('2023-01-01') + pd.to_timedelta(rng.integers(0, 730 * 24, rows), unit='h')
+    dates = dates.sort_values()
+    amounts = rng.lognormal(7.5, 1.0, rows).round().astype(np.int64)
+    payees = np.asarray(PAYEES, dtype=object)[rng.integers(0, len(PAYEES), rows)]
+    if layout == 'plain':
+        return [], ['利用日', 'ご利用先', '利用金額'], [dates.to_pydatetime(), payees, amounts.tolist()]
+    if layout == 'footer':
+        return [], ['利用日', 'ご利用先', '利用金額'], [
+            list(dates.to_pydatetime()) + [None], list(payees) + ['以上'], amounts.tolist() + [None],
+        ]
+    if layout == 'preamble':
+        preamble = [['ご利用明細書'], ['口座番号', '1234567'], ['期間', '2023/01/01〜2024/12/31'], [], ['お客様各位']]
+        return preamble, ['取引日', '摘要', 'お支払金額'], [
+            dates.strftime('%Y/%m/%d').tolist(), payees, [f"{a:,}円" for a in amounts],
+        ]
+    if layout == 'english':
+        return [['Statement'], []], ['Date', 'Description', 'Amount'], [
+            dates.strftime('%Y-%m-%d').tolist(), payees, amounts.tolist(),
+        ]
+    if layout == 'fullwidth':
+        return [['明細書（令和）']], ['日付', '内容', '金額'], [
+            [_era_date(d) for d in dates], payees, [f"{a:,}".translate(FULLWIDTH_DIGITS) for a in amounts],
+        ]
+    if layout == 'wide':
+        header = ['No', '利用日', '店舗コード', 'ご利用先', '支払区分', '利用金額', '手数料', '備考']
+        values = [
+            list(range(1, rows + 1)), dates.to_pydatetime(), [f"{c:08d}" for c in rng.integers(0, 10 ** 8, rows)],
+            payees, ['1回'] * rows, amounts.tolist(), [0] * rows, ['メモ'] * rows,
+        ]
+        for i in range(len(header), WIDE_COLUMNS):
+            header.append(f"項目{i}")
+            values.append(rng.integers(0, 1000, rows).tolist())
+        return [['カードご利用明細']], header, values
+    raise ValueError(f"未知の形式: {layout}")
+
+def make_statement(layout, rows, seed=0):
+    """合成した明細の.xlsxをbytesで返す"""
+    preamble, header, values = _columns(layout, rows, np.random.default_rng(seed))
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet()
+    for line in preamble:
+        ws.append(line)
+    ws.append(header)
+    for row in zip(*values):
+        ws.append(row)
+    buf = io.BytesIO()
+    wb.save(buf)
+    return buf.getvalue()
+
+def cached_statement(layout, rows, cache_dir, seed=0):
+    """生成済みの明細があれば読み、なければ生成して保存する"""
+    path = os.path.join(cache_dir, f"{layout}_{rows}_{seed}.xlsx")
+    if os.path.isfile(path):
+        with open(path, 'rb') as f:
+            return f.read()
+    data = make_statement(layout, rows, seed)
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(path + '.part', 'wb') as f:
+        f.write(data)
+    os.replace(path + '.part', path)
+    return data
+
+# --- 計測前の確認 ---
+def check_normalizers():
+    """欠損値だけの列（ストリーミング読み込みの最後の区切りなど）を各正規化関数が扱えるか確認する"""
+    missing = pd.Series([None, None], dtype=object)
+    if not normalize_amounts(missing).isna().all():
+        raise AssertionError("normalize_amounts: 欠損値がNaNになりません")
+    if not normalize_dates(missing).isna().all():
+        raise AssertionError("normalize_dates: 欠損値がNaTになりません")
+    if not normalize_descriptions(missing).eq('').all():
+        raise AssertionError("normalize_descriptions: 欠損値が空文字になりません")
+
+# --- 計測 ---
+def _timed(func, repeat):
+    """funcをrepeat回実行し、(最後の戻り値, 各回の秒数) を返す"""
+    seconds = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        value = func()
+        seconds.append(time.perf_counter() - started)
+    return value, seconds
+
+def run_stages(data, repeat=1, preview_rows=HEADER_PREVIEW_ROWS, charts=True):
+    """1つの明細について段階ごとの秒数（{段階: [秒, ...]}）を計測する"""
+    timings = {}
+    df, timings['read_excel_with_auto_header'] = _timed(lambda: read_excel_with_auto_header(data, preview_rows), repeat)
+    preview = pd.read_excel(io.BytesIO(data), header=None, nrows=preview_rows)
+    _, timings['detect_header_row'] = _timed(lambda: detect_header_row(preview), repeat)
+    (date_col, amount_col), timings['find_date_and_amount_columns'] = _timed(
+        lambda: find_date_and_amount_columns(df), repeat)
+    if not (date_col and amount_col):
+        raise ValueError("日付や金額の列が見つかりませんでした")
+    payee_col = find_columns(df)['payee']
+    (transactions, _), timings['normalize'] = _timed(
+        lambda: normalize_transactions(df, date_col, amount_col, payee_col), repeat)
+    if '摘要' not in transactions:
+        transactions['摘要'] = ''
+    transactions, timings['categorize'] = _timed(lambda: add_categories(transactions), repeat)
+    aggregates, timings['aggregate'] = _timed(lambda: compute_aggregates(transactions), repeat)
+    _, timings['detect'] = _timed(lambda: detect_findings(transactions), repeat)
+    if charts:
+        # matplotlibとフォントの初期化は計測に含めない
+        from expense_charts import available_charts, render_chart
+        from expense_fonts import get_fontproperties
+        get_fontproperties()
+        _, timings['render_charts'] = _timed(
+            lambda: [render_chart(kind, aggregates) for kind in available_charts(aggregates)], repeat)
+        # ブラウザ描画用のグラフ定義（Vega-LiteのJSON）を作るまでの時間
+        from expense_altair import altair_chart
+        _, timings['altair_charts'] = _timed(
+            lambda: [altair_chart(kind, aggregates).to_dict() for kind in available_charts(aggregates)], repeat)
+    streamed, timings['read_excel_streaming'] = _timed(lambda: read_excel_streaming(data, preview_rows, keep_payee=True), repeat)
+    streamed_df, streamed_date, streamed_amount, _, _ = streamed
+    streamed_rows = len(normalize_transactions(streamed_df, streamed_date, streamed_amount)[0])
+    if streamed_rows != len(transactions):
+        raise ValueError(f"省メモリ読み込みの件数が一致しません: {streamed_rows}件（通常は{len(transactions)}件）")
+    return timings
+
+def _git_commit():
+    try:
+        out = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, timeout=10,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        )
+        return out.stdout.strip() or None
+    except Exception:
+        return None
+
+def run_benchmark(sizes=DEFAULT_SIZES, layouts=LAYOUTS, repeat=3, cache_dir=None, charts=True, log=None):
+    """形式×件数ごとに計測し、JSONに書き出せる結果（dict）を返す"""
+    cache_dir = cache_dir or os.path.join(tempfile.gettempdir(), 'expense_bench')
+    check_normalizers()
+    results = []
+    for layout in layouts:
+        for rows in sizes:
+            data = cached_statement(layout, rows, cache_dir)
+            timings = run_stages(data, repeat, charts=charts)
+            for stage, seconds in timings.items():
+                results.append({
+                    'layout': layout, 'rows': rows, 'bytes': len(data), 'stage': stage,
+                    'min': min(seconds), 'median': statistics.median(seconds), 'repeat': len(seconds),
+                })
+            if log:
+                total = sum(min(s) for s in timings.values())
+                log(f"{layout:>10} {rows:>8}行 {total:8.3f}s")
+    return {
+        'meta': {
+            'commit': _git_commit(),
+            'created': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'numpy': np.__version__,
+            'openpyxl': openpyxl.__version__,
+            'platform': platform.platform(),
+        },
+        'results': results,
+    }
+
+# --- 結果の比較 ---
+def compare_results(base, new, threshold=COMPARE_THRESHOLD, min_seconds=COMPARE_MIN_SECONDS):
+    """2つの計測結果を (形式, 件数, 段階) ごとに比べた表と、遅くなった段階があるかを返す"""
+    key = ['layout', 'rows', 'stage']
+    merged = pd.DataFrame(base['results']).merge(pd.DataFrame(new['results']), on=key, suffixes=('_base', '_new'))
+    table = merged[key + ['min_base', 'min_new']].copy()
+    table['ratio'] = table['min_new'] / table['min_base']
+    table['regressed'] = (table['ratio'] > threshold) & (table['min_new'] >= min_seconds)
+    return table, bool(table['regressed'].any())
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="合成した明細で解析パイプラインの段階ごとの処理時間を計測する")
+    parser.add_argument("--sizes", default=','.join(map(str, DEFAULT_SIZES)), help="行数（カンマ区切り、最大1000000程度）")
+    parser.add_argument("--layouts", default=','.join(LAYOUTS), help=f"明細の形式（{', '.join(LAYOUTS)}）")
+    parser.add_argument("--repeat", type=int, default=3, help="各段階の繰り返し回数（最小値と中央値を記録）")
+    parser.add_argument("--cache-dir", default=None, help="生成した明細の保存先（既定: 一時ディレクトリ）")
+    parser.add_argument("--no-charts", action="store_true", help="グラフ描画を計測しない")
+    parser.add_argument("-o", "--output", default=None, help="結果のJSONの保存先（既定: 標準出力）")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"), help="2つの結果JSONを比較する")
+    parser.add_argument("--threshold", type=float, default=COMPARE_THRESHOLD, help="遅くなったとみなす比率")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0], encoding='utf-8') as f:
+            base = json.load(f)
+        with open(args.compare[1], encoding='utf-8') as f:
+            new = json.load(f)
+        table, regressed = compare_results(base, new, args.threshold)
+        with pd.option_context('display.max_rows', None, 'display.width', 200):
+            print(table.to_string(index=False, float_format=lambda v: f"{v:.4f}"))
+        return 1 if regressed else 0
+
+    layouts = [l for l in args.layouts.split(',') if l]
+    unknown = set(layouts) - set(LAYOUTS)
+    if unknown:
+        parser.error(f"未知の形式: {', '.join(sorted(unknown))}")
+    sizes = [int(s) for s in args.sizes.split(',') if s]
+    report = run_benchmark(
+        sizes, layouts, args.repeat, args.cache_dir, not args.no_charts,
+        log=lambda message: print(message, file=sys.stderr),
+    )
+    text = json.dumps(report, ensure_ascii=False, indent=1)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        print(text)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
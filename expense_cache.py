@@ -0,0 +1,104 @@
+"""プロセス全体で共有する、メモリ量の上限付きLRUキャッシュ（解析済みデータと集計結果用）
+
+同じ明細を複数の利用者・セッションが開いても、解析結果は内容ハッシュをキーに1つだけ保持する。
+セッションにはキー（ハンドル）だけを持たせ、実体はこのキャッシュから取り出す。
+合計サイズが上限を超えたら、最も長く使われていないものから捨てる。
+"""
+import collections
+import os
+import sys
+import threading
+
+import numpy as np
+import pandas as pd
+
+CACHE_BUDGET_ENV = "EXPENSE_CACHE_MB"
+DEFAULT_BUDGET_MB = 256
+
+def estimate_size(value):
+    """値のおおよそのメモリ量（バイト）。DataFrame・配列・dict/list/tupleの中身も数える"""
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        usage = value.memory_usage(deep=True)
+        return int(usage.sum() if isinstance(value, pd.DataFrame) else usage)
+    if isinstance(value, pd.Index):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, np.ndarray):
+        return int(value.nbytes)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(estimate_size(k) + estimate_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(estimate_size(v) for v in value)
+    return sys.getsizeof(value)
+
+class DatasetCache:
+    """合計サイズ（バイト）の上限付きLRUキャッシュ。ヒット・ミス・追い出しの回数を数える
+
+    取り出した値は共有されるため、呼び出し側で変更しないこと。
+    """
+
+    def __init__(self, budget_bytes=None):
+        if budget_bytes is None:
+            budget_bytes = int(float(os.environ.get(CACHE_BUDGET_ENV, DEFAULT_BUDGET_MB)) * 2 ** 20)
+        self.budget_bytes = budget_bytes
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # 上限より大きく、保持しなかった値の数
+        self.rejected = 0
+
+    def get(self, key):
+        """値を返す（なければNone）。取り出した値は最近使ったものとして扱う"""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+            self.misses += 1
+            return None
+
+    def put(self, key, value, size=None):
+        """値を保持し、上限を超えた分を古いものから追い出す"""
+        size = estimate_size(value) if size is None else size
+        with self._lock:
+            if key in self._entries:
+                self.size_bytes -= self._entries.pop(key)[1]
+            if size > self.budget_bytes:
+                self.rejected += 1
+                return value
+            self._entries[key] = (value, size)
+            self.size_bytes += size
+            while self.size_bytes > self.budget_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.size_bytes -= evicted
+                self.evictions += 1
+        return value
+
+    def get_or_create(self, key, build):
+        """キャッシュ済みの値を返し、なければbuild()で作って保持する"""
+        value = self.get(key)
+        if value is None:
+            # 作成中はロックを持たない（同じキーを同時に作った場合は後の値で置き換える）
+            value = self.put(key, build())
+        return value
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'size_mb': round(self.size_bytes / 2 ** 20, 1),
+                'budget_mb': round(self.budget_bytes / 2 ** 20, 1),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'rejected': self.rejected,
+            }
+
+# プロセス全体で共有するキャッシュ（Streamlitのスクリプト再実行ではリセットされない）
+dataset_cache = DatasetCache()
@@ -0,0 +1,123 @@
+"""支出分類表（支出分類表.xlsx）にもとづく取引の分類
+
+分類表の各分類名と、分類ごとのキーワード（店名・サービス名）を1つの正規表現にまとめ、
+摘要の種類ごとに1回だけ照合して全取引に分類を付ける。結果はpandasのCategoricalで持つ。
+"""
+import functools
+import logging
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+CATEGORY_TABLE_ENV = "EXPENSE_CATEGORY_TABLE"
+CATEGORY_TABLE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "支出分類表.xlsx")
+OTHER_CATEGORY = "その他"
+MONTH_LABEL_RE = re.compile(r'\s*\d{1,2}月\s*')
+# 分類名そのものに加えて摘要と照合するキーワード（NFKC正規化・大文字化して照合する）
+CATEGORY_KEYWORDS = {
+    '食費': [
+        'スーパー', 'イオン', 'AEON', 'イトーヨーカドー', '西友', 'ライフ', 'マルエツ', 'サミット', '業務スーパー',
+        'オーケー', '成城石井', 'まいばすけっと', '生協', 'コープ', 'COOP', '精肉', '鮮魚', '青果', 'ベーカリー',
+        'セブン-イレブン', 'セブンイレブン', 'ファミリーマート', 'ローソン',
+    ],
+    '外食費': [
+        'レストラン', '食堂', 'カフェ', 'CAFE', 'スターバックス', 'STARBUCKS', 'ドトール', 'タリーズ', 'コメダ',
+        'マクドナルド', "MCDONALD", 'モスバーガー', 'ケンタッキー', '吉野家', 'すき家', '松屋', 'ガスト', 'サイゼリヤ',
+        'デニーズ', 'くら寿司', 'スシロー', '居酒屋', 'ラーメン', 'UBER EATS', '出前館', 'WOLT',
+    ],
+    '日用品': [
+        'ドラッグ', 'マツモトキヨシ', 'ウエルシア', 'スギ薬局', 'ツルハ', 'サンドラッグ', 'ダイソー', 'セリア',
+        'キャンドゥ', 'ニトリ', '無印良品', 'ホームセンター', 'カインズ', 'コーナン', 'ロフト',
+    ],
+    '家賃': ['家賃', '賃料', '管理費', '共益費', '不動産'],
+    '水道代': ['水道'],
+    '電気代': ['電気', '電力', 'でんき'],
+    '保険': ['保険', '生命', '損保', '共済'],
+}
+
+def _normalize(texts):
+    return texts.astype(str).str.normalize('NFKC').str.upper()
+
+def category_table_path():
+    return os.environ.get(CATEGORY_TABLE_ENV) or CATEGORY_TABLE_PATH
+
+def load_category_table(path=None):
+    """分類表を読み込み、分類名と月予算（入力済みの月の平均）の表を返す
+
+    分類表は「3月」「4月」…の見出し行の左隣の列に分類名が並ぶ形式。
+    """
+    path = path or category_table_path()
+    raw = pd.read_excel(path, header=None)
+    is_month = raw.applymap(lambda v: isinstance(v, str) and MONTH_LABEL_RE.fullmatch(v) is not None).to_numpy()
+    rows, cols = is_month.nonzero()
+    if len(rows) == 0:
+        raise ValueError(f"分類表の月の見出しが見つかりません: {path}")
+    header_row = rows.min()
+    month_cols = raw.columns[is_month[header_row]]
+    label_col = raw.columns[raw.columns.get_loc(month_cols[0]) - 1]
+    body = raw.iloc[header_row + 1:]
+    labels = body[label_col]
+    is_category = labels.map(lambda v: isinstance(v, str) and v.strip() != '').to_numpy(dtype=bool)
+    budgets = body.loc[is_category, month_cols].apply(pd.to_numeric, errors='coerce')
+    return pd.DataFrame({
+        '分類': labels[is_category].str.strip().to_numpy(),
+        '月予算': budgets.where(budgets > 0).mean(axis=1).to_numpy(),
+    })
+
+class CategoryMatcher:
+    """分類ごとのキーワードを1つの正規表現にまとめた照合器"""
+
+    def __init__(self, keywords_by_category):
+        self.categories = list(keywords_by_category) + [OTHER_CATEGORY]
+        self._code_by_keyword = {}
+        for code, (category, keywords) in enumerate(keywords_by_category.items()):
+            for keyword in [category, *keywords]:
+                normalized = _normalize(pd.Series([keyword])).iloc[0]
+                # 同じキーワードが複数の分類にある場合は先の分類を優先
+                self._code_by_keyword.setdefault(normalized, code)
+        # 長いキーワードを先に試す（「業務スーパー」を「スーパー」より優先）
+        alternatives = sorted(self._code_by_keyword, key=len, reverse=True)
+        self.pattern = re.compile('(' + '|'.join(re.escape(k) for k in alternatives) + ')')
+
+    def classify(self, descriptions):
+        """摘要の列を分類のCategoricalにする（照合は摘要の種類ごとに1回）"""
+        codes, uniques = pd.factorize(descriptions)
+        other = len(self.categories) - 1
+        matched = _normalize(pd.Series(uniques, dtype=object)).str.extract(self.pattern, expand=False)
+        unique_codes = matched.map(self._code_by_keyword).fillna(other).to_numpy(dtype=np.int64)
+        category_codes = np.where(codes >= 0, unique_codes[np.maximum(codes, 0)] if len(unique_codes) else other, other)
+        return pd.Categorical.from_codes(category_codes, categories=self.categories)
+
+@functools.lru_cache(maxsize=None)
+def category_table():
+    """分類表（プロセス内で1回だけ読み込む）。読み込めない場合は組み込みの分類のみ"""
+    path = category_table_path()
+    try:
+        return load_category_table(path)
+    except Exception as e:
+        logger.warning("分類表を読み込めないため組み込みの分類のみを使います: %s (%s: %s)", path, type(e).__name__, e)
+        return pd.DataFrame({'分類': list(CATEGORY_KEYWORDS), '月予算': np.nan})
+
+@functools.lru_cache(maxsize=None)
+def default_matcher():
+    """分類表の分類に組み込みキーワードを合わせた照合器（1回だけ構築する）"""
+    return CategoryMatcher({c: CATEGORY_KEYWORDS.get(c, []) for c in category_table()['分類']})
+
+def add_categories(transactions, matcher=None):
+    """摘要から分類を付けた取引表を返す（摘要がない場合や分類済みの場合はそのまま返す）"""
+    if '分類' in transactions or '摘要' not in transactions or not transactions['摘要'].astype(bool).any():
+        return transactions
+    out = transactions.copy()
+    out['分類'] = (matcher or default_matcher()).classify(out['摘要'])
+    return out
+
+def budget_comparison(categories, table=None):
+    """分類別集計に分類表の月予算と予算差（月平均 - 月予算）を付ける"""
+    table = category_table() if table is None else table
+    out = categories.join(table.set_index('分類')['月予算'], how='left')
+    out['予算差'] = out['月平均'] - out['月予算']
+    return out
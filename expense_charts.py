@@ -0,0 +1,95 @@
+"""集計結果からのグラフ描画（matplotlibのFigureを直接使い、PNGをLRUキャッシュする）"""
+import collections
+import io
+import threading
+
+import numpy as np
+from matplotlib.figure import Figure
+
+from expense_core import CHART_TITLES, available_charts
+from expense_fonts import get_fontproperties
+
+# --- グラフ描画（PNGを指紋でキャッシュ） ---
+CHART_SIZE = (6, 2.5)
+CHART_DPI = 200
+CHART_CACHE_ENTRIES = 64
+
+class ChartCache:
+    """描画済みPNGのLRUキャッシュ（キーは (データの指紋, グラフの種類)）"""
+
+    def __init__(self, max_entries=CHART_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_render(self, key, render):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        png = render()
+        with self._lock:
+            self._entries[key] = png
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return png
+
+# プロセス全体で共有するキャッシュ
+chart_cache = ChartCache()
+
+def _style_ticks(ax, fp, rotation=None):
+    for label in ax.get_xticklabels() + ax.get_yticklabels():
+        label.set_fontproperties(fp)
+        label.set_fontsize(9)
+    if rotation is not None:
+        for label in ax.get_xticklabels():
+            label.set_rotation(rotation)
+
+def render_chart(kind, aggregates):
+    """集計結果からグラフを描画してPNGのbytesを返す（pyplotの状態は使わない）"""
+    fp = get_fontproperties()
+    fig = Figure(figsize=CHART_SIZE)
+    ax = fig.subplots()
+    if kind == 'monthly':
+        monthly = aggregates['monthly']
+        ax.bar(range(len(monthly)), monthly.to_numpy(), width=0.5, color="#1976D2")
+        ax.set_xticks(range(len(monthly)))
+        ax.set_xticklabels(monthly.index.strftime('%Y-%m'))
+        ax.set_xlabel('', fontproperties=fp)
+        ax.set_ylabel('金額', fontproperties=fp)
+        rotation = 45
+    elif kind == 'histogram':
+        counts, edges = aggregates['histogram']
+        ax.bar(edges[:-1], counts, width=np.diff(edges), align='edge', color="#43A047", edgecolor='white', alpha=0.75)
+        ax.set_xlabel('金額', fontproperties=fp)
+        ax.set_ylabel('件数', fontproperties=fp)
+        rotation = None
+    elif kind == 'weekday':
+        weekday = aggregates['weekday']
+        ax.bar(range(len(weekday)), weekday.to_numpy(), width=0.5, color="#FBC02D")
+        ax.set_xticks(range(len(weekday)))
+        ax.set_xticklabels(weekday.index)
+        ax.set_xlabel('', fontproperties=fp)
+        ax.set_ylabel('平均金額', fontproperties=fp)
+        rotation = 90
+    elif kind == 'category':
+        totals = aggregates['categories']['合計金額']
+        ax.barh(range(len(totals)), totals.to_numpy(), height=0.5, color="#8E24AA")
+        ax.set_yticks(range(len(totals)))
+        ax.set_yticklabels(totals.index)
+        ax.invert_yaxis()
+        ax.set_xlabel('金額', fontproperties=fp)
+        rotation = None
+    else:
+        raise ValueError(f"未知のグラフ種類: {kind}")
+    ax.set_title(CHART_TITLES[kind], fontsize=13, fontproperties=fp)
+    _style_ticks(ax, fp, rotation)
+    fig.tight_layout()
+    buf = io.BytesIO()
+    fig.savefig(buf, format='png', dpi=CHART_DPI, bbox_inches='tight')
+    return buf.getvalue()
+
+def chart_png(kind, fingerprint, aggregates):
+    """キャッシュ済みのPNGを返し、なければ描画する"""
+    return chart_cache.get_or_render((fingerprint, kind), lambda: render_chart(kind, aggregates))
@@ -0,0 +1,760 @@
+"""支出明細の解析処理（Streamlitに依存しないコア部分）
+
+読み込み（read_excel_with_auto_header / read_excel_streaming）、ヘッダー・列の検出
+（detect_header_row / find_date_and_amount_columns）、正規化、集計をまとめる。
+Webアプリ（expense_analyzer.py）と一括処理CLI（expense_batch.py）の両方から使う。
+"""
+import concurrent.futures
+import contextlib
+import datetime
+import hashlib
+import io
+import itertools
+import multiprocessing
+import os
+import re
+import threading
+import time
+
+import numpy as np
+import openpyxl
+import pandas as pd
+
+# --- ヘッダー行の検出（プレビュー全体をまとめてスコアリング） ---
+DATE_KEYWORDS = ['日付', 'date', 'DATE', '日', '年月日', '取引日', '日時', 'timestamp', '日付/時間']
+AMOUNT_KEYWORDS = [
+    '金額', '金', 'amount', 'AMOUNT', '円', '¥', '支出', '支払', '合計', 'total', 'price', '価格',
+    '出金', '引出', 'debit', 'withdrawal',
+]
+DATE_KEYWORD_RE = re.compile('|'.join(re.escape(k) for k in DATE_KEYWORDS))
+AMOUNT_KEYWORD_RE = re.compile('|'.join(re.escape(k) for k in AMOUNT_KEYWORDS))
+# 特徴量: 空白でないセル数, 文字列セル数, 日付キーワードの有無, 金額キーワードの有無
+HEADER_SCORE_WEIGHTS = np.array([1, 2, 3, 3])
+
+def header_score_matrix(df_preview):
+    """プレビュー各行の特徴量行列（行数×4）を作る"""
+    block = df_preview.reset_index(drop=True)
+    features = np.zeros((len(block), len(HEADER_SCORE_WEIGHTS)), dtype=np.int64)
+    cells = block.stack()  # 空白でないセルのみ
+    if cells.empty:
+        return features
+    row_pos = cells.index.get_level_values(0).to_numpy()
+    is_str = cells.map(type).eq(str).to_numpy()
+    texts = cells[is_str].astype(str).str.lower()
+    str_rows = row_pos[is_str]
+    np.add.at(features[:, 0], row_pos, 1)
+    np.add.at(features[:, 1], str_rows, 1)
+    features[np.unique(str_rows[texts.str.contains(DATE_KEYWORD_RE).to_numpy()]), 2] = 1
+    features[np.unique(str_rows[texts.str.contains(AMOUNT_KEYWORD_RE).to_numpy()]), 3] = 1
+    return features
+
+HEADER_CANDIDATES = 3
+
+def rank_header_rows(df_preview):
+    """ヘッダー行の候補をスコア順に返す（row, score, confidence。同点は上の行が先）"""
+    scores = header_score_matrix(df_preview) @ HEADER_SCORE_WEIGHTS
+    # 全列が文字列で両キーワードを含む行を1.0とした相対値
+    max_score = 3 * df_preview.shape[1] + 6
+    ranked = pd.DataFrame({
+        'row': df_preview.index,
+        'score': scores,
+        'confidence': np.clip(scores / max_score, 0, 1) if max_score else 0.0,
+    })
+    return ranked.sort_values('score', ascending=False, kind='mergesort').reset_index(drop=True)
+
+def detect_header_row(df_preview, ranking=None):
+    """列名として最適な行（rank_header_rowsの1位）を検出する。rankingには計算済みの順位表を渡せる"""
+    if len(df_preview) == 0:
+        return 0
+    if ranking is None:
+        ranking = rank_header_rows(df_preview)
+    return ranking['row'].iloc[0]
+
+# --- 列の種類推定（サンプルの一致率から日付・金額・支払先・分類の候補を順位付け） ---
+PAYEE_KEYWORDS = ['摘要', '内容', '利用先', '利用店', '店名', '加盟店', '取引先', '支払先', '明細', '内訳', '品名', 'description', 'payee', 'merchant', 'memo', 'store', 'shop']
+CATEGORY_KEYWORDS = ['分類', 'カテゴリ', '費目', 'ジャンル', '種別', 'category']
+PAYEE_KEYWORD_RE = re.compile('|'.join(re.escape(k) for k in PAYEE_KEYWORDS))
+CATEGORY_KEYWORD_RE = re.compile('|'.join(re.escape(k) for k in CATEGORY_KEYWORDS))
+# 番号・コード・残高の列（数値でも金額の候補としては順位を下げる）。英字は単語の一部には一致させない
+ID_KEYWORDS = ['番号', 'コード', '残高', 'no', 'id', 'code', 'ref', 'reference', 'balance', '#']
+ID_KEYWORD_RE = re.compile('|'.join(
+    re.escape(k) if not k.isascii() or not k.isalpha() else f'(?<![a-z]){k}(?![a-z])' for k in ID_KEYWORDS
+))
+# 値の判定用（\dは全角数字にも一致する）
+DATE_VALUE_RE = re.compile(
+    r'\s*(?:\d{4}\s*[-/.年]\s*\d{1,2}\s*[-/.月]\s*\d{1,2}'  # YYYY-MM-DD・日本語形式
+    r'|\d{1,2}[-/]\d{1,2}[-/]\d{4}'                          # DD-MM-YYYY
+    r'|(?:令和|平成|昭和|[RHS])\s*(?:\d{1,2}|元)\s*[年./-])'   # 和暦
+)
+# 桁区切りありは任意の桁数、なしは7桁まで（ID・電話番号・口座番号を除外）
+AMOUNT_VALUE_RE = re.compile(
+    r'\s*[(（]?[-−△▲+]?\s*[¥￥]?\s*(?:\d{1,3}(?:[,，]\d{3})+|\d{1,7})(?:[.．]\d+)?\s*円?[)）]?\s*'
+)
+# 数字と記号だけの文字列（電話番号・会員番号など）はテキストとして扱わない
+NUMERIC_CODE_RE = re.compile(r'[\d\s\-−‐()（）+#*]+')
+# 数値のセルも文字列と同じく7桁まで（8桁以上の整数はID・参照番号とみなす）
+MAX_PLAIN_AMOUNT = 1e7
+COLUMN_TYPES = ['date', 'amount', 'payee', 'category']
+PROFILE_STAGES = (20, 100)      # まず20行で判定し、決まらない列だけ100行まで見る
+CLEAR_RATIO = 0.95
+MIN_CONTENT_RATIO = 0.5
+NAME_WEIGHT = 0.5
+ID_NAME_PENALTY = 0.75
+
+def _cell_flags(block):
+    """サンプルの非空セルごとに日付・金額・テキスト判定を行い、列ごとの一致率を返す"""
+    cells = block.stack()
+    columns = pd.Index(block.columns)
+    if cells.empty:
+        return pd.DataFrame(0.0, index=columns, columns=['date', 'amount', 'large', 'text', 'distinct', 'count'])
+    col_pos = cells.index.get_level_values(1)
+    kinds = cells.map(type)
+    is_str = (kinds == str).to_numpy()
+    # 型の判定はセルごとではなく出現した型ごとに1回だけ行う
+    type_set = kinds.unique()
+    dt_types = {t: issubclass(t, (datetime.date, np.datetime64)) for t in type_set}
+    num_types = {t: issubclass(t, (int, float, np.number)) and not issubclass(t, (bool, np.bool_)) for t in type_set}
+    is_dt = kinds.map(dt_types).to_numpy(dtype=bool)
+    is_num = kinds.map(num_types).to_numpy(dtype=bool)
+
+    date_hit = is_dt.copy()
+    amount_hit = np.zeros(len(cells), dtype=bool)
+    large_hit = np.zeros(len(cells), dtype=bool)
+    text_hit = np.zeros(len(cells), dtype=bool)
+    if is_num.any():
+        numbers = pd.to_numeric(cells[is_num], errors='coerce').abs()
+        amount_hit[is_num] = (numbers < MAX_PLAIN_AMOUNT).to_numpy()
+        large_hit[is_num] = (numbers >= MAX_PLAIN_AMOUNT).to_numpy()
+    if is_str.any():
+        texts = cells[is_str].astype(str)
+        str_date = texts.str.match(DATE_VALUE_RE).to_numpy()
+        str_amount = texts.str.fullmatch(AMOUNT_VALUE_RE).to_numpy()
+        date_hit[is_str] = str_date
+        amount_hit[is_str] = str_amount & ~str_date
+        str_code = texts.str.fullmatch(NUMERIC_CODE_RE).to_numpy()
+        text_hit[is_str] = ~(str_date | str_amount | str_code) & texts.str.strip().ne('').to_numpy()
+
+    flags = pd.DataFrame({'date': date_hit, 'amount': amount_hit, 'large': large_hit, 'text': text_hit}, index=col_pos)
+    stats = flags.groupby(level=0).mean()
+    stats['count'] = flags.groupby(level=0).size()
+    stats['distinct'] = cells.astype(str).groupby(col_pos).nunique() / stats['count']
+    return stats.reindex(columns).fillna(0.0)
+
+def _is_counter(series):
+    """1ずつ増える連番（No.列など）かどうか"""
+    values = pd.to_numeric(series.dropna(), errors='coerce').to_numpy()
+    return len(values) > 2 and bool(np.all(np.diff(values) == 1))
+
+def column_profile(df):
+    """列ごとの名前一致と内容一致率の表を作る（行: 列名、列: 種類ごとの指標）"""
+    columns = pd.Index(df.columns)
+    names = pd.Series([str(c).lower() for c in columns], index=columns, dtype=object)
+    profile = pd.DataFrame(index=columns)
+    profile['name_date'] = names.str.contains(DATE_KEYWORD_RE)
+    # 日付の列名に一致した列は金額の列名としては扱わない
+    profile['name_amount'] = names.str.contains(AMOUNT_KEYWORD_RE) & ~profile['name_date']
+    profile['name_id'] = names.str.contains(ID_KEYWORD_RE)
+    profile['name_payee'] = names.str.contains(PAYEE_KEYWORD_RE)
+    profile['name_category'] = names.str.contains(CATEGORY_KEYWORD_RE)
+
+    frame = df.head(PROFILE_STAGES[-1]).set_axis(range(len(columns)), axis=1)
+    stats = None
+    pending = list(range(len(columns)))
+    for rows in PROFILE_STAGES:
+        stage = _cell_flags(frame[pending].head(rows))
+        stats = stage if stats is None else stage.combine_first(stats)
+        # 日付・金額がはっきり決まった列は打ち切り、曖昧な列だけ次の段階で再評価
+        decided = ((stage[['date', 'amount']] >= CLEAR_RATIO) | (stage[['date', 'amount']] <= 1 - CLEAR_RATIO)).all(axis=1)
+        pending = [c for c in pending if not decided.get(c, True)]
+        # 列名と内容の両方で日付・金額列が確定していれば残りは見ない
+        clear = stats.set_axis(columns[stats.index])
+        has_date = (profile['name_date'] & (clear['date'] >= CLEAR_RATIO).reindex(columns, fill_value=False)).any()
+        has_amount = (profile['name_amount'] & (clear['amount'] >= CLEAR_RATIO).reindex(columns, fill_value=False)).any()
+        if not pending or (has_date and has_amount):
+            break
+    stats = stats.reindex(range(len(columns))).fillna(0.0).set_axis(columns)
+    for i, col in enumerate(columns):
+        if stats.at[col, 'amount'] >= MIN_CONTENT_RATIO and _is_counter(frame[i].head(PROFILE_STAGES[-1])):
+            stats.at[col, 'amount'] = 0.0
+    return profile.join(stats)
+
+def profile_columns(df):
+    """種類（date/amount/payee/category）ごとに (列名, スコア) の候補リストをスコア順で返す"""
+    p = column_profile(df)
+    w = NAME_WEIGHT
+    # 8桁以上の数値は、列名が金額を示す（番号・残高ではない）列でだけ金額として数える
+    amount = p['amount'] + p['large'] * (p['name_amount'] & ~p['name_id'])
+    scores = {
+        'date': (w * p['name_date'] + p['date']).where(p['date'] >= MIN_CONTENT_RATIO),
+        'amount': (w * p['name_amount'] - ID_NAME_PENALTY * p['name_id'] + amount).where(amount >= MIN_CONTENT_RATIO),
+        'payee': (w * p['name_payee'] + p['text'] * p['distinct']).where(
+            (p['text'] >= MIN_CONTENT_RATIO) & (p['name_payee'] | (p['distinct'] >= 0.2))),
+        'category': (w * p['name_category'] + p['text'] * (1 - p['distinct'])).where(
+            (p['text'] >= MIN_CONTENT_RATIO) & (p['name_category'] | ((p['distinct'] <= 0.2) & (p['count'] * p['distinct'] >= 2)))),
+    }
+    return {
+        kind: [(col, float(score)) for col, score in s.dropna().sort_values(ascending=False, kind='mergesort').items()]
+        for kind, s in scores.items()
+    }
+
+def find_columns(df):
+    """日付・金額・支払先・分類の列をそれぞれ1つずつ、重複しないように選ぶ"""
+    ranked = profile_columns(df)
+    chosen = {}
+    for kind in COLUMN_TYPES:
+        used = set(chosen.values())
+        chosen[kind] = next((col for col, _ in ranked[kind] if col not in used), None)
+    return chosen
+
+def find_date_and_amount_columns(df):
+    """日付と金額の列を探す（列名と内容の一致率から判定）"""
+    chosen = find_columns(df)
+    return chosen['date'], chosen['amount']
+
+# --- Excel読み込み（1回のパースでヘッダー検出と本体構築を行う） ---
+HEADER_PREVIEW_ROWS = 20
+MAX_HEADER_PREVIEW_ROWS = 500
+
+def read_upload_bytes(uploaded_file):
+    """アップロードファイル（UploadedFile・パス・ファイルオブジェクト）の中身をbytesで取得"""
+    if isinstance(uploaded_file, (bytes, bytearray)):
+        return bytes(uploaded_file)
+    if isinstance(uploaded_file, (str, os.PathLike)):
+        with open(uploaded_file, 'rb') as f:
+            return f.read()
+    if hasattr(uploaded_file, 'getvalue'):
+        return uploaded_file.getvalue()
+    uploaded_file.seek(0)
+    return uploaded_file.read()
+
+def content_digest(data):
+    """アップロード内容のハッシュ（キャッシュキー）"""
+    return hashlib.sha256(data).hexdigest()
+
+def _header_names(header):
+    """ヘッダー行の値から列名を作る（pd.read_excelと同じく空欄はUnnamed、重複は連番）"""
+    names = []
+    seen = {}
+    for i, value in enumerate(header):
+        name = f"Unnamed: {i}" if pd.isna(value) else value
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+def frame_from_raw(raw, header_row):
+    """ヘッダーなしで読み込んだシートから、指定行を列名としたDataFrameを作る"""
+    df = raw.iloc[header_row + 1:].reset_index(drop=True)
+    df.columns = _header_names(raw.iloc[header_row].tolist())
+    return df.infer_objects()
+
+def parse_excel_bytes(data, preview_rows=HEADER_PREVIEW_ROWS):
+    """ワークブックを1回だけ読み込み、先頭行からヘッダーを検出して本体を構築"""
+    raw = pd.read_excel(io.BytesIO(data), header=None)
+    header_row = detect_header_row(raw.head(preview_rows))
+    return frame_from_raw(raw, header_row)
+
+def read_excel_with_auto_header(uploaded_file, preview_rows=HEADER_PREVIEW_ROWS):
+    """Excelファイルを読み込み、最適なヘッダー行を自動検出"""
+    return parse_excel_bytes(read_upload_bytes(uploaded_file), preview_rows)
+
+# --- 金額・日付の正規化（全角数字・円記号・△/括弧のマイナス・和暦に対応） ---
+AMOUNT_TRANSLATION = str.maketrans({
+    **{chr(0xFF10 + i): str(i) for i in range(10)},
+    '，': None, ',': None, '．': '.',
+    '¥': None, '￥': None, '円': None, '+': None, '＋': None, ' ': None, '　': None,
+    '△': '-', '▲': '-', '−': '-', '－': '-', '‐': '-',
+    '(': '-', '（': '-', ')': None, '）': None,
+})
+DATE_TRANSLATION = str.maketrans({
+    **{chr(0xFF10 + i): str(i) for i in range(10)},
+    '／': '/', '－': '-', '．': '.', '：': ':', '　': ' ',
+    '年': '-', '月': '-', '日': None,
+})
+ERA_OFFSETS = {'令和': 2018, 'R': 2018, '平成': 1988, 'H': 1988, '昭和': 1925, 'S': 1925}
+ERA_DATE_RE = re.compile(r'(令和|平成|昭和|[RHS])\s*(\d{1,2}|元)\s*[年./-]\s*(\d{1,2})\s*[月./-]\s*(\d{1,2})\s*日?')
+ERA_MARK_RE = re.compile(r'令和|平成|昭和|[RHS]\s*(?:\d|元)')
+WEEKDAY_SUFFIX_RE = re.compile(r'\s*[(（][月火水木金土日][)）]')
+DATE_FORMATS = [
+    '%Y-%m-%d', '%Y/%m/%d', '%Y-%m-%d %H:%M:%S', '%Y/%m/%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y/%m/%d %H:%M',
+    '%Y.%m.%d', '%Y%m%d', '%m/%d/%Y', '%d/%m/%Y', '%y/%m/%d', '%m/%d/%y',
+]
+EXCEL_SERIAL_RANGE = (20000, 80000)  # 1954年〜2119年のExcelシリアル値
+DATE_FORMAT_SAMPLE = 50
+
+def _factorize(series):
+    """重複する値を1回だけ処理するため、値の種類とその位置に分解する"""
+    codes, uniques = pd.factorize(series)
+    return codes, pd.Series(uniques, dtype=object)
+
+def _take(values, codes, fill):
+    # 元の並びに戻す（欠損値のコードは-1、すべて欠損の場合はvaluesが空）
+    if len(values) == 0:
+        return np.full(len(codes), fill, dtype=values.dtype)
+    out = values[np.maximum(codes, 0)]
+    out[codes < 0] = fill
+    return out
+
+def normalize_amounts(series):
+    """金額列をfloat64に変換（全角数字・カンマ・円記号・△や括弧のマイナスを1回の変換で処理）"""
+    if pd.api.types.is_numeric_dtype(series):
+        return series.astype('float64')
+    codes, uniques = _factorize(series)
+    cleaned = uniques.astype(str).str.strip().str.translate(AMOUNT_TRANSLATION)
+    values = pd.to_numeric(cleaned, errors='coerce').to_numpy(dtype='float64')
+    return pd.Series(_take(values, codes, np.nan), index=series.index)
+
+def _era_to_western(match):
+    era, year, month, day = match.groups()
+    year = 1 if year == '元' else int(year)
+    return f"{ERA_OFFSETS[era] + year}-{month}-{day}"
+
+def _infer_date_format(texts, format_cache):
+    """先頭の値の形から書式を推定し、同じ列の同じ形の値では推定結果を使い回す
+
+    format_cacheは値の形（数字を9に置換した文字列）から書式へのdictで、1つの列の中だけで共有する。
+    """
+    shape = re.sub(r'\d', '9', texts.iloc[0])
+    if shape in format_cache:
+        return format_cache[shape]
+    sample = texts.head(DATE_FORMAT_SAMPLE)
+    best, best_count = None, 0
+    for fmt in DATE_FORMATS:
+        count = pd.to_datetime(sample, format=fmt, errors='coerce').notna().sum()
+        if count > best_count:
+            best, best_count = fmt, count
+            if count == len(sample):
+                break
+    format_cache[shape] = best
+    return best
+
+def _parse_with_format(texts, format_cache):
+    """推定した書式で一括変換（書式が決まらない値はNaT）"""
+    parsed = pd.Series(pd.NaT, index=texts.index, dtype='datetime64[ns]')
+    present = texts.ne('')
+    if present.any():
+        fmt = _infer_date_format(texts[present], format_cache)
+        if fmt:
+            parsed[present] = pd.to_datetime(texts[present], format=fmt, errors='coerce')
+    return parsed
+
+def _clean_date_texts(texts):
+    """全角数字・年月日・和暦・曜日表記をISO風の文字列にそろえる"""
+    texts = texts.str.translate(DATE_TRANSLATION)
+    if texts.str.contains(ERA_MARK_RE).any():
+        texts = texts.str.replace(ERA_DATE_RE, _era_to_western, regex=True)
+    return texts.str.replace(WEEKDAY_SUFFIX_RE, '', regex=True).str.strip().str.rstrip('-')
+
+def _parse_date_texts(texts, format_cache):
+    """日付文字列をdatetime64に変換（そのまま読めない値だけ正規化してから再変換）"""
+    parsed = _parse_with_format(texts, format_cache)
+    rest = parsed.isna() & texts.ne('')
+    if rest.any():
+        cleaned = _clean_date_texts(texts[rest])
+        parsed[rest] = _parse_with_format(cleaned, format_cache)
+        # 書式に合わなかった値だけ汎用の解析にかける
+        left = parsed[rest].isna() & cleaned.ne('')
+        if left.any():
+            parsed[left[left].index] = pd.to_datetime(cleaned[left], errors='coerce')
+    return parsed
+
+def normalize_dates(series, format_cache=None):
+    """日付列をdatetime64に変換（日本語表記・和暦・全角数字・Excelシリアル値に対応）
+
+    列を分割して変換する場合は、同じformat_cache（dict）を渡して推定した書式を列の中で共有する。
+    """
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series
+    format_cache = {} if format_cache is None else format_cache
+    codes, uniques = _factorize(series)
+    parsed = pd.Series(pd.NaT, index=uniques.index, dtype='datetime64[ns]')
+    if len(uniques):
+        kinds = uniques.map(type)
+        type_set = kinds.unique()
+        is_str = kinds.eq(str)
+        is_num = kinds.map({t: issubclass(t, (int, float, np.number)) and not issubclass(t, (bool, np.bool_)) for t in type_set}).astype(bool)
+        numbers = pd.to_numeric(uniques[is_num], errors='coerce')
+        is_serial = (is_num & numbers.between(*EXCEL_SERIAL_RANGE).reindex(uniques.index, fill_value=False)).astype(bool)
+        if is_serial.any():
+            parsed[is_serial] = pd.to_datetime(numbers[is_serial[is_num]], unit='D', origin='1899-12-30')
+        if is_str.any():
+            parsed[is_str] = _parse_date_texts(uniques[is_str].astype(str), format_cache)
+        # 20240105のような整数は文字列として解析
+        is_int = is_num & ~is_serial
+        if is_int.any():
+            digits = numbers[is_int[is_num]].dropna()
+            digits = digits[digits == digits.round()].astype('int64').astype(str)
+            parsed[digits.index] = _parse_date_texts(digits, format_cache)
+        others = ~(is_str | is_num)
+        if others.any():
+            parsed[others] = pd.to_datetime(uniques[others], errors='coerce')
+    values = parsed.to_numpy(dtype='datetime64[ns]')
+    return pd.Series(_take(values, codes, np.datetime64('NaT')), index=series.index)
+
+def normalize_descriptions(series):
+    """摘要（支払先）をNFKCで正規化した文字列にする（欠損は空文字）"""
+    codes, uniques = _factorize(series)
+    cleaned = uniques.astype(str).str.normalize('NFKC').str.strip().to_numpy(dtype=object)
+    return pd.Series(_take(cleaned, codes, ''), index=series.index, dtype=object)
+
+def normalize_transactions(df, date_col, amount_col, payee_col=None):
+    """日付・金額（・摘要）列を正規化した取引表と、値はあるが解釈できずに除外した行数を返す"""
+    out = pd.DataFrame({
+        '日付': normalize_dates(df[date_col], {}),
+        '金額': normalize_amounts(df[amount_col]),
+    })
+    valid = out.notna().all(axis=1)
+    dropped = int((df[[date_col, amount_col]].notna().all(axis=1) & ~valid).sum())
+    if payee_col is not None:
+        out['摘要'] = normalize_descriptions(df[payee_col])
+    return out[valid].reset_index(drop=True), dropped
+
+# --- 大容量ファイル向けストリーミング読み込み ---
+STREAMING_THRESHOLD_BYTES = 8 * 1024 * 1024
+STREAM_CHUNK_ROWS = 10000
+STREAM_SAMPLE_ROWS = 100
+
+def _cell(row, index):
+    # 読み取り専用モードでは末尾の空セルが省略された行があるため範囲外はNone
+    return row[index] if index < len(row) else None
+
+def read_excel_streaming(uploaded_file, preview_rows=HEADER_PREVIEW_ROWS, chunk_rows=STREAM_CHUNK_ROWS, keep_payee=False):
+    """openpyxlの読み取り専用モードで行を逐次処理し、日付・金額列だけを型付き配列として保持
+
+    戻り値は (df, date_col, amount_col, dropped, header_candidates)。dropped は値はあるが日付・金額として
+    解釈できなかった行数、header_candidates はヘッダー行の上位の候補（rank_header_rowsの先頭）。
+    列が見つからない場合は列確認用のサンプルと None を返す。
+    keep_payee=True の場合は支払先の列（見つかれば）も3列目として保持する。
+    """
+    data = read_upload_bytes(uploaded_file)
+    wb = openpyxl.load_workbook(io.BytesIO(data), read_only=True, data_only=True)
+    try:
+        rows = wb.worksheets[0].iter_rows(values_only=True)
+        head = list(itertools.islice(rows, preview_rows))
+        if not head:
+            return pd.DataFrame(), None, None, 0, None
+        preview = pd.DataFrame(head)
+        ranking = rank_header_rows(preview)
+        header_row = detect_header_row(preview, ranking)
+        header_candidates = ranking.head(HEADER_CANDIDATES)
+        # 列の検出はヘッダー直後のサンプル行だけで行う
+        sample_rows = head[header_row + 1:] + list(itertools.islice(rows, STREAM_SAMPLE_ROWS))
+        sample = frame_from_raw(pd.DataFrame(head[:header_row + 1] + sample_rows), header_row)
+        chosen = find_columns(sample)
+        date_col, amount_col = chosen['date'], chosen['amount']
+        payee_col = chosen['payee'] if keep_payee else None
+        if not (date_col and amount_col):
+            return sample, date_col, amount_col, 0, header_candidates
+        date_idx = sample.columns.get_loc(date_col)
+        amount_idx = sample.columns.get_loc(amount_col)
+        payee_idx = sample.columns.get_loc(payee_col) if payee_col is not None else None
+
+        date_chunks, amount_chunks, payee_chunks = [], [], []
+        date_buf, amount_buf, payee_buf = [], [], []
+        # 日付の書式推定はチャンクをまたいでこの列の中だけで共有する
+        format_cache = {}
+        dropped = 0
+
+        def flush():
+            nonlocal dropped
+            raw_dates = pd.Series(date_buf, dtype=object)
+            raw_amounts = pd.Series(amount_buf, dtype=object)
+            dates = normalize_dates(raw_dates, format_cache).to_numpy(dtype='datetime64[ns]')
+            amounts = normalize_amounts(raw_amounts).to_numpy(dtype='float64')
+            # 値はあるのに解釈できなかった行（変換後は欠損値と区別できないためここで数える）
+            present = (raw_dates.notna() & raw_amounts.notna()).to_numpy()
+            dropped += int((present & (np.isnat(dates) | np.isnan(amounts))).sum())
+            date_chunks.append(dates)
+            amount_chunks.append(amounts)
+            payee_chunks.append(np.array(payee_buf, dtype=object))
+            date_buf.clear()
+            amount_buf.clear()
+            payee_buf.clear()
+
+        for row in itertools.chain(sample_rows, rows):
+            date_buf.append(_cell(row, date_idx))
+            amount_buf.append(_cell(row, amount_idx))
+            if payee_idx is not None:
+                payee_buf.append(_cell(row, payee_idx))
+            if len(date_buf) >= chunk_rows:
+                flush()
+        if date_buf or not date_chunks:
+            flush()
+    finally:
+        wb.close()
+    columns = {
+        date_col: np.concatenate(date_chunks),
+        amount_col: np.concatenate(amount_chunks),
+    }
+    if payee_idx is not None:
+        columns[payee_col] = np.concatenate(payee_chunks)
+    return pd.DataFrame(columns), date_col, amount_col, dropped, header_candidates
+
+# --- 複数明細の一括読み込み（プロセスプールで並列解析し、ファイル間の重複を除外） ---
+TRANSACTION_COLUMNS = ['日付', '金額', '摘要', 'ファイル']
+PARSE_WORKERS = int(os.environ.get('EXPENSE_PARSE_WORKERS', '0')) or (os.cpu_count() or 1)
+_parse_executor = None
+_parse_executor_lock = threading.Lock()
+
+def parse_executor():
+    """プロセス全体で共有する解析用のプロセスプール（最初に使うときに作る）
+
+    同時に何人がアップロードしてもワーカー数はPARSE_WORKERSまでに抑える。
+    Streamlitのサーバーは複数スレッドで動くため、forkではなくforkserver（なければspawn）で起動する。
+    """
+    global _parse_executor
+    with _parse_executor_lock:
+        if _parse_executor is None:
+            method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            _parse_executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=PARSE_WORKERS, mp_context=multiprocessing.get_context(method),
+            )
+        return _parse_executor
+
+def _discard_parse_executor(executor):
+    # ワーカーが異常終了したプールは使えないため、次の呼び出しで作り直す
+    global _parse_executor
+    with _parse_executor_lock:
+        if _parse_executor is executor:
+            _parse_executor = None
+    executor.shutdown(wait=False)
+
+@contextlib.contextmanager
+def _timed(timings, stage):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = time.perf_counter() - started
+
+def load_statement(name, data, preview_rows=HEADER_PREVIEW_ROWS, streaming=False):
+    """1つの明細を読み込み、ヘッダー・列の検出と正規化まで行う
+
+    戻り値はファイルごとの結果（dict）。transactions は列が見つからない場合 None。
+    transactions_count は取り込んだ取引の件数（transactionsを破棄した後も一覧表に使う）。
+    header_candidates はヘッダー行の上位の候補（row, score, confidence）。
+    timings には段階（Excelの解析・ヘッダー検出・列の検出・正規化）ごとの秒数が入る。
+    """
+    result = {
+        'name': name, 'rows': 0, 'date_col': None, 'amount_col': None, 'payee_col': None,
+        'dropped': 0, 'columns': [], 'head': None, 'transactions': None, 'transactions_count': 0,
+        'header_candidates': None, 'error': None, 'timings': {},
+    }
+    timings = result['timings']
+    # 読み込み時に解釈できなかった行数（ストリーミングでは変換済みの値しか残らないため）
+    read_dropped = 0
+    try:
+        if streaming and name.lower().endswith('.xlsx'):
+            with _timed(timings, 'excel_streaming'):
+                df, date_col, amount_col, read_dropped, header_candidates = read_excel_streaming(
+                    data, preview_rows, keep_payee=True)
+            payee_col = df.columns[2] if date_col and amount_col and df.shape[1] > 2 else None
+        else:
+            with _timed(timings, 'excel_parse'):
+                raw = pd.read_excel(io.BytesIO(data), header=None)
+            with _timed(timings, 'detect_header'):
+                preview = raw.head(preview_rows)
+                ranking = rank_header_rows(preview)
+                df = frame_from_raw(raw, detect_header_row(preview, ranking))
+            header_candidates = ranking.head(HEADER_CANDIDATES)
+            with _timed(timings, 'find_columns'):
+                chosen = find_columns(df)
+            date_col, amount_col, payee_col = chosen['date'], chosen['amount'], chosen['payee']
+        result.update(header_candidates=header_candidates, rows=len(df), date_col=date_col, amount_col=amount_col, payee_col=payee_col,
+                      columns=df.columns.tolist())
+        if not (date_col and amount_col):
+            result['head'] = df.head()
+            return result
+        with _timed(timings, 'normalize'):
+            transactions, dropped = normalize_transactions(df, date_col, amount_col, payee_col)
+        if '摘要' not in transactions:
+            transactions['摘要'] = ''
+        transactions['ファイル'] = name
+        result.update(transactions=transactions[TRANSACTION_COLUMNS], transactions_count=len(transactions),
+                      dropped=read_dropped + dropped)
+    except Exception as e:
+        result['error'] = str(e)
+    return result
+
+def _load_statement_job(job):
+    # プロセスプールから呼ぶためトップレベルに置く
+    return load_statement(*job)
+
+def transaction_keys(transactions):
+    """取引ごとの重複判定キー（(日付, 金額, 摘要) のハッシュと、同じファイル内での出現順）"""
+    key = pd.util.hash_pandas_object(transactions[['日付', '金額', '摘要']], index=False)
+    occurrence = key.groupby([transactions['ファイル'], key]).cumcount()
+    return pd.DataFrame({'key': key, 'occurrence': occurrence})
+
+def merge_statements(frames):
+    """複数明細の取引を結合し、(日付, 金額, 摘要) のハッシュでファイル間の重複を除く
+
+    同じファイル内で同じ取引が複数回ある場合（同日・同額・同じ店での利用）は残すため、
+    ファイル内での出現順も含めて比較する。戻り値は (取引表, 除外した件数)。
+    """
+    if not frames:
+        return pd.DataFrame(columns=TRANSACTION_COLUMNS), 0
+    combined = pd.concat(frames, ignore_index=True)
+    duplicated = transaction_keys(combined).duplicated().to_numpy()
+    merged = combined[~duplicated].sort_values('日付', kind='mergesort').reset_index(drop=True)
+    return merged, int(duplicated.sum())
+
+def load_statements(files, preview_rows=HEADER_PREVIEW_ROWS, streaming=False, max_workers=None):
+    """複数の明細 [(ファイル名, bytes)] を並列に読み込んで結合する
+
+    戻り値は (取引表, ファイルごとの結果のリスト, 重複として除外した件数)。
+    """
+    jobs = [(name, data, preview_rows, streaming) for name, data in files]
+    results = None
+    if min(len(jobs), max_workers or PARSE_WORKERS) > 1:
+        executor = parse_executor()
+        try:
+            results = list(executor.map(_load_statement_job, jobs))
+        except concurrent.futures.BrokenExecutor:
+            _discard_parse_executor(executor)
+    if results is None:
+        results = [_load_statement_job(job) for job in jobs]
+    merged, duplicates = merge_statements([r['transactions'] for r in results if r['transactions'] is not None])
+    return merged, results, duplicates
+
+def _chosen_header(result):
+    # 選んだヘッダー行のExcelの行番号（1始まり）と確信度
+    candidates = result['header_candidates']
+    if candidates is None or candidates.empty:
+        return None, None
+    return int(candidates['row'].iloc[0]) + 1, round(float(candidates['confidence'].iloc[0]), 2)
+
+def header_candidates_text(result):
+    """ヘッダー行の候補を「3行目（確信度 0.82）」の形で並べた文字列（候補がなければ空文字）"""
+    candidates = result['header_candidates']
+    if candidates is None or candidates.empty:
+        return ''
+    return '、'.join(f"{int(row) + 1}行目（確信度 {conf:.2f}）" for row, conf in zip(candidates['row'], candidates['confidence']))
+
+def statement_summary(results):
+    """ファイルごとの検出結果の一覧表"""
+    rows = []
+    for r in results:
+        header_row, confidence = _chosen_header(r)
+        rows.append({
+            'ファイル': r['name'],
+            '取引件数': r['transactions_count'],
+            'ヘッダー行': header_row,
+            'ヘッダーの確信度': confidence,
+            '日付列': r['date_col'],
+            '金額列': r['amount_col'],
+            '摘要列': r['payee_col'],
+            '除外件数': r['dropped'],
+            'エラー': r['error'],
+        })
+    return pd.DataFrame(rows)
+
+# --- 集計（月次・ヒストグラム・曜日別・基本統計量を1回で計算） ---
+WEEKDAY_NAMES = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+HISTOGRAM_BINS = 30
+STAT_LABELS = ['count', 'mean', 'std', 'min', '25%', '50%', '75%', 'max']
+CHART_TITLES = {
+    'monthly': '月次支出の推移',
+    'histogram': '日次支出の分布',
+    'weekday': '曜日別の平均支出',
+    'category': '分類別の支出',
+}
+
+def available_charts(aggregates):
+    """集計結果から描けるグラフの種類（分類別は摘要から分類を付けた場合のみ）"""
+    return [kind for kind in CHART_TITLES if kind != 'category' or 'categories' in aggregates]
+
+def data_fingerprint(df):
+    """正規化済みの日付・金額（と摘要）から指紋を作る（集計・グラフのキャッシュキー）"""
+    columns = [c for c in ('日付', '金額', '摘要') if c in df]
+    hashed = pd.util.hash_pandas_object(df[columns], index=False).to_numpy()
+    return hashlib.sha1(hashed.tobytes()).hexdigest()
+
+def compute_aggregates(df):
+    """グラフと統計表に必要な集計を、文字列整形なしの整数キーでまとめて計算"""
+    dates = df['日付'].to_numpy(dtype='datetime64[ns]')
+    amounts = df['金額'].to_numpy(dtype='float64')
+
+    # 月次合計（1970-01からの月数をキーに集計）
+    month_keys, month_idx = np.unique(dates.astype('datetime64[M]').astype(np.int64), return_inverse=True)
+    monthly = pd.Series(
+        np.bincount(month_idx, weights=amounts, minlength=len(month_keys)),
+        index=pd.PeriodIndex(pd.DatetimeIndex(month_keys.astype('datetime64[M]').astype('datetime64[ns]')), freq='M'),
+        name='金額',
+    )
+
+    # 曜日別平均（1970-01-01は木曜日=3）
+    weekday_idx = (dates.astype('datetime64[D]').astype(np.int64) + 3) % 7
+    weekday_sum = np.bincount(weekday_idx, weights=amounts, minlength=7)
+    weekday_count = np.bincount(weekday_idx, minlength=7)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        weekday = pd.Series(np.where(weekday_count > 0, weekday_sum / weekday_count, np.nan), index=WEEKDAY_NAMES, name='金額')
+
+    counts, edges = np.histogram(amounts, bins=HISTOGRAM_BINS) if len(amounts) else (np.zeros(0, dtype=np.int64), np.zeros(1))
+
+    # describe()と同じ項目を1回のソートで計算
+    n = len(amounts)
+    if n:
+        quantiles = np.percentile(amounts, [0, 25, 50, 75, 100])
+        std = amounts.std(ddof=1) if n > 1 else np.nan
+        stats = [n, amounts.mean(), std, *quantiles]
+    else:
+        stats = [0] + [np.nan] * 7
+    monthly_count = np.bincount(month_idx, minlength=len(month_keys))
+    aggregates = {
+        'monthly': monthly,
+        'monthly_count': monthly_count,
+        # 月ごとの行位置（月の取引を全件走査せずに取り出すための索引）
+        'month_rows': (np.argsort(month_idx, kind='stable'), np.concatenate(([0], np.cumsum(monthly_count)))),
+        'histogram': (counts, edges),
+        'weekday': weekday,
+        'weekday_count': weekday_count,
+        'stats': pd.Series(stats, index=STAT_LABELS, name='金額', dtype='float64'),
+    }
+    if '分類' in df:
+        aggregates['categories'] = category_aggregates(df['分類'], amounts, len(month_keys))
+    return aggregates
+
+def category_aggregates(categories, amounts, months):
+    """分類（Categorical）ごとの合計・件数・構成比・月平均をコードのbincountで計算"""
+    categories = pd.Categorical(categories)
+    size = len(categories.categories)
+    totals = np.bincount(categories.codes, weights=amounts, minlength=size)
+    counts = np.bincount(categories.codes, minlength=size)
+    grand_total = totals.sum()
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return pd.DataFrame({
+            '合計金額': totals,
+            '件数': counts,
+            '構成比': totals / grand_total if grand_total else np.nan,
+            '月平均': totals / months if months else np.nan,
+        }, index=pd.Index(categories.categories, name='分類'))
+
+def month_transactions(df, aggregates, month):
+    """集計時の索引を使って、指定した月（'YYYY-MM'）の取引だけを取り出す"""
+    position = aggregates['monthly'].index.strftime('%Y-%m').get_loc(month)
+    order, starts = aggregates['month_rows']
+    return df.iloc[order[starts[position]:starts[position + 1]]]
+
+def summary_tables(aggregates):
+    """集計結果を出力用の表（月次・曜日別・基本統計量、あれば分類別）にする"""
+    monthly = aggregates['monthly']
+    tables = {
+        'monthly': pd.DataFrame({
+            '月': monthly.index.strftime('%Y-%m'),
+            '合計金額': monthly.to_numpy(),
+            '件数': aggregates['monthly_count'],
+        }),
+        'weekday': pd.DataFrame({
+            '曜日': WEEKDAY_NAMES,
+            '平均金額': aggregates['weekday'].to_numpy(),
+            '件数': aggregates['weekday_count'],
+        }),
+        'stats': aggregates['stats'].rename_axis('統計量').reset_index(),
+    }
+    if 'categories' in aggregates:
+        tables['categories'] = aggregates['categories'].reset_index()
+    return tables
@@ -0,0 +1,172 @@
+"""定期的な支出（サブスクリプションなど）と高額支出（外れ値）の検出
+
+どちらもグループ化と並べ替えをNumPyの配列演算で行い、取引ごとのPythonループを使わない。
+
+- 定期的な支出: 摘要と金額が同じ取引をまとめ、日付順の間隔がほぼ一定のものを検出する
+- 高額支出: 分類ごとの中央値とMAD（中央絶対偏差）によるロバストzスコアが大きいものを検出する
+"""
+import numpy as np
+import pandas as pd
+
+RECURRING_MIN_COUNT = 4
+RECURRING_MAX_CV = 0.15
+# どの間隔も平均間隔からこの割合以上ずれない（月末・休日による前後を許容）
+RECURRING_MAX_DEVIATION = 0.35
+# 周期の名前・日数・許容差（平均間隔がどれにも当たらない繰り返しは偶然とみなす）
+RECURRING_PERIODS = [('毎週', 7, 1.5), ('隔週', 14, 2.5), ('毎月', 30.44, 4), ('隔月', 60.88, 6), ('四半期ごと', 91.31, 10), ('毎年', 365.25, 20)]
+OUTLIER_THRESHOLD = 3.5
+OUTLIER_MIN_GROUP = 8
+MAD_SCALE = 1.4826
+
+def _days(dates):
+    return dates.to_numpy(dtype='datetime64[ns]').astype('datetime64[s]').astype(np.int64) / 86400.0
+
+def _group_medians(values, groups, n_groups):
+    """グループごとの中央値（(グループ, 値) で1回並べ替えて中央の要素を取る）"""
+    order = np.lexsort((values, groups))
+    sorted_values = values[order]
+    counts = np.bincount(groups, minlength=n_groups)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    lower = sorted_values[np.minimum(starts + (counts - 1) // 2, len(values) - 1)] if len(values) else np.zeros(n_groups)
+    upper = sorted_values[np.minimum(starts + counts // 2, len(values) - 1)] if len(values) else np.zeros(n_groups)
+    return np.where(counts > 0, (lower + upper) / 2, np.nan)
+
+def _period_codes(intervals):
+    """平均間隔に当たる周期の番号（RECURRING_PERIODSの位置、当たらなければ-1）"""
+    days = np.array([p[1] for p in RECURRING_PERIODS])
+    tolerance = np.array([p[2] for p in RECURRING_PERIODS])
+    hits = np.abs(intervals[:, None] - days[None, :]) <= tolerance[None, :]
+    return np.where(hits.any(axis=1), hits.argmax(axis=1), -1)
+
+def find_recurring(transactions, min_count=RECURRING_MIN_COUNT, max_cv=RECURRING_MAX_CV):
+    """摘要と金額が同じで、ほぼ一定の間隔で繰り返す支出を月換算額の大きい順に返す"""
+    columns = ['摘要', '金額', '周期', '回数', '平均間隔(日)', '初回', '最終', '次回予定', '月換算']
+    if '摘要' not in transactions or len(transactions) < min_count:
+        return pd.DataFrame(columns=columns)
+    payees = transactions['摘要'].fillna('').to_numpy(dtype=object)
+    named = payees != ''
+    payee_codes, payee_uniques = pd.factorize(payees[named])
+    amount_codes, amount_uniques = pd.factorize(transactions['金額'].to_numpy(dtype='float64')[named])
+    groups, keys = pd.factorize(payee_codes.astype(np.int64) * len(amount_uniques) + amount_codes)
+    days = _days(transactions['日付'])[named]
+
+    # (グループ, 日付) で並べ、同じグループ内の隣り合う取引の間隔を求める
+    order = np.lexsort((days, groups))
+    groups, days = groups[order], days[order]
+    same = groups[1:] == groups[:-1]
+    gaps = np.diff(days)[same]
+    gap_groups = groups[1:][same]
+    n = len(keys)
+    counts = np.bincount(groups, minlength=n)
+    gap_count = np.bincount(gap_groups, minlength=n)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_gap = np.bincount(gap_groups, weights=gaps, minlength=n) / gap_count
+        var_gap = np.bincount(gap_groups, weights=(gaps - mean_gap[gap_groups]) ** 2, minlength=n) / gap_count
+        cv = np.sqrt(var_gap) / mean_gap
+        max_deviation = np.zeros(n)
+        np.maximum.at(max_deviation, gap_groups, np.abs(gaps - mean_gap[gap_groups]) / mean_gap[gap_groups])
+    periods = _period_codes(mean_gap)
+    recurring = (counts >= min_count) & (periods >= 0) & (cv <= max_cv) & (max_deviation <= RECURRING_MAX_DEVIATION)
+    idx = np.flatnonzero(recurring)
+    if len(idx) == 0:
+        return pd.DataFrame(columns=columns)
+
+    first = np.full(n, np.inf)
+    last = np.full(n, -np.inf)
+    np.minimum.at(first, groups, days)
+    np.maximum.at(last, groups, days)
+    amounts = amount_uniques[keys[idx] % len(amount_uniques)]
+    to_datetime = lambda d: pd.to_datetime(d * 86400, unit='s')
+    result = pd.DataFrame({
+        '摘要': payee_uniques[keys[idx] // len(amount_uniques)],
+        '金額': amounts,
+        '周期': [RECURRING_PERIODS[p][0] for p in periods[idx]],
+        '回数': counts[idx],
+        '平均間隔(日)': mean_gap[idx].round(1),
+        '初回': to_datetime(first[idx]),
+        '最終': to_datetime(last[idx]),
+        '次回予定': to_datetime(last[idx] + mean_gap[idx]).normalize(),
+        '月換算': (amounts * 30.44 / mean_gap[idx]).round(0),
+    })
+    return result.sort_values('月換算', ascending=False, kind='stable').reset_index(drop=True)
+
+def _robust_baseline(amounts, groups, n_groups):
+    """グループごとの (中央値, MAD×1.4826)。MADが0のグループは平均絶対偏差で代用する"""
+    medians = _group_medians(amounts, groups, n_groups)
+    deviations = np.abs(amounts - medians[groups])
+    mads = _group_medians(deviations, groups, n_groups) * MAD_SCALE
+    counts = np.bincount(groups, minlength=n_groups)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_abs = np.bincount(groups, weights=deviations, minlength=n_groups) / counts * 1.2533
+    return medians, np.where(mads > 0, mads, mean_abs)
+
+def find_outliers(transactions, threshold=OUTLIER_THRESHOLD, min_group=OUTLIER_MIN_GROUP):
+    """分類ごとのロバストzスコアが閾値を超える高額支出をスコアの大きい順に返す
+
+    件数がmin_group未満の分類は全取引の中央値・MADを基準にする。MADが0の場合は平均絶対偏差で代用する。
+    """
+    amounts = transactions['金額'].to_numpy(dtype='float64')
+    if '分類' in transactions:
+        groups, categories = pd.factorize(transactions['分類'])
+    else:
+        groups, categories = np.zeros(len(amounts), dtype=np.int64), pd.Index(['全体'])
+    # 分類のない取引（-1）は最後のグループにまとめる
+    n_groups = len(categories) + 1
+    groups = np.where(groups < 0, n_groups - 1, groups)
+    medians, scales = _robust_baseline(amounts, groups, n_groups)
+    # 件数の少ない分類の取引は、全取引を1つのグループとした基準と比べる
+    overall_median, overall_scale = _robust_baseline(amounts, np.zeros(len(amounts), dtype=np.int64), 1)
+    small = (np.bincount(groups, minlength=n_groups) < min_group)[groups]
+    baseline = np.where(small, overall_median[0], medians[groups])
+    scale = np.where(small, overall_scale[0], scales[groups])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        scores = (amounts - baseline) / scale
+    flagged = np.flatnonzero(np.nan_to_num(scores, nan=0.0, posinf=0.0) > threshold)
+    result = transactions.iloc[flagged][[c for c in ('日付', '金額', '摘要', '分類', 'ファイル') if c in transactions]].copy()
+    result['基準額'] = baseline[flagged]
+    result['スコア'] = scores[flagged].round(1)
+    return result.sort_values('スコア', ascending=False, kind='stable').reset_index(drop=True)
+
+def detect_findings(transactions):
+    """定期的な支出と高額支出をまとめて検出する"""
+    return {
+        'recurring': find_recurring(transactions),
+        'outliers': find_outliers(transactions),
+    }
+
+def consult_prefill(findings):
+    """相談ページの質問に、検出結果から下書きの回答を作る（質問のキー: 回答）"""
+    prefill = {}
+    outliers = findings['outliers']
+    # 分類（「その他」以外）を優先し、なければ摘要を使う
+    labels = []
+    for column in ('分類', '摘要'):
+        if column in outliers and not labels:
+            labels = [v for v in pd.unique(outliers[column].astype(str)) if v not in ('', 'その他')][:3]
+    if labels:
+        prefill['high_expense_purpose'] = '、'.join(labels)
+    recurring = findings['recurring']
+    if len(recurring):
+        prefill['current_concerns'] = '、'.join(f"{p}（{c}）" for p, c in zip(recurring['摘要'][:3], recurring['周期'][:3]))
+    return prefill
+
+def advice_lines(findings):
+    """検出結果にもとづくアドバイス（箇条書きの文字列のリスト）"""
+    lines = []
+    recurring = findings['recurring']
+    if len(recurring):
+        monthly = recurring['月換算'].sum()
+        top = recurring.iloc[0]
+        lines.append(
+            f"定期的な支出が{len(recurring)}件、月あたり約¥{monthly:,.0f}あります。"
+            f"最も大きいのは「{top['摘要']}」（{top['周期']}・¥{top['金額']:,.0f}）です。利用していないサービスは解約を検討しましょう。"
+        )
+    outliers = findings['outliers']
+    if len(outliers):
+        top = outliers.iloc[0]
+        where = f"「{top['摘要']}」" if top.get('摘要') else ''
+        lines.append(
+            f"通常より大きい支出が{len(outliers)}件（合計¥{outliers['金額'].sum():,.0f}）ありました。"
+            f"最大は{top['日付']:%Y-%m-%d}の{where}¥{top['金額']:,.0f}で、基準となる中央値¥{top['基準額']:,.0f}を大きく上回っています。"
+        )
+    return lines
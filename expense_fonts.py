@@ -0,0 +1,137 @@
+"""日本語フォントの解決とmatplotlibへの登録
+
+グラフ描画時にはネットワークへアクセスしない。フォントは次の順で探す。
+
+1. 環境変数 EXPENSE_FONT_DIR で指定したディレクトリ
+2. このファイルと同じ場所の fonts/ ディレクトリ（同梱用）
+3. 一時ディレクトリ（以前の版がダウンロードしたファイル）
+4. システムにインストール済みの日本語フォント
+
+フォントを事前に取得する場合は `python expense_fonts.py --download` を実行する。
+"""
+import argparse
+import functools
+import logging
+import os
+import tempfile
+import time
+import urllib.request
+
+import matplotlib as mpl
+import matplotlib.font_manager as fm
+
+logger = logging.getLogger(__name__)
+
+FONT_DIR_ENV = "EXPENSE_FONT_DIR"
+BUNDLED_FONT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fonts")
+# 優先順（ファイル名: 取得元URL）
+FONT_FILES = {
+    "ipaexg.ttf": "https://github.com/googlefonts/ipafont/raw/main/fonts/ttf/ipaexg.ttf",
+    "NotoSansCJKjp-Regular.otf": "https://github.com/googlefonts/noto-cjk/raw/main/Sans/OTF/Japanese/NotoSansCJKjp-Regular.otf",
+}
+# ファイルが見つからない場合に使うインストール済みフォント
+SYSTEM_FONT_NAMES = [
+    "IPAexGothic", "IPAGothic", "Noto Sans CJK JP", "Noto Sans JP", "Hiragino Sans",
+    "Hiragino Maru Gothic Pro", "Yu Gothic", "Meiryo", "TakaoGothic", "VL Gothic",
+]
+FALLBACK_FONT_NAMES = ["Arial", "sans-serif"]
+DOWNLOAD_TIMEOUT = 30
+
+def font_search_dirs():
+    """フォントファイルを探すディレクトリ（優先順）"""
+    dirs = []
+    if os.environ.get(FONT_DIR_ENV):
+        dirs.append(os.environ[FONT_DIR_ENV])
+    dirs += [BUNDLED_FONT_DIR, tempfile.gettempdir()]
+    return dirs
+
+def find_font_files():
+    """ローカルにある日本語フォントファイルのパスを返す（ダウンロードはしない）"""
+    paths = []
+    for filename in FONT_FILES:
+        for directory in font_search_dirs():
+            path = os.path.join(directory, filename)
+            if os.path.isfile(path):
+                paths.append(path)
+                break
+    return paths
+
+@functools.lru_cache(maxsize=None)
+def setup_japanese_fonts():
+    """フォントをmatplotlibに1回だけ登録し、rcParamsを設定する
+
+    戻り値は (フォント名のタプル, 登録したフォントファイルのタプル)。
+    """
+    started = time.perf_counter()
+    names = []
+    registered = []
+    for path in find_font_files():
+        try:
+            fm.fontManager.addfont(path)
+            name = fm.FontProperties(fname=path).get_name()
+        except Exception:
+            logger.warning("フォントを登録できませんでした: %s", path)
+            continue
+        registered.append(path)
+        if name not in names:
+            names.append(name)
+    installed = {f.name for f in fm.fontManager.ttflist}
+    names += [n for n in SYSTEM_FONT_NAMES if n in installed and n not in names]
+    if not names:
+        logger.warning("日本語フォントが見つかりません。`python expense_fonts.py --download` で取得できます。")
+    mpl.rcParams['font.family'] = names + FALLBACK_FONT_NAMES
+    mpl.rcParams['axes.unicode_minus'] = False
+    logger.info("font setup: %d fonts in %.3fs", len(names), time.perf_counter() - started)
+    return tuple(names), tuple(registered)
+
+@functools.lru_cache(maxsize=None)
+def get_fontproperties():
+    """グラフのラベル用FontProperties（最初に見つかった日本語フォントを優先、結果は使い回す）"""
+    names, registered = setup_japanese_fonts()
+    if registered:
+        return fm.FontProperties(fname=registered[0])
+    if names:
+        return fm.FontProperties(family=names[0])
+    return fm.FontProperties()
+
+def download_fonts(dest_dir=BUNDLED_FONT_DIR, timeout=DOWNLOAD_TIMEOUT):
+    """フォントをdest_dirへダウンロードする（デプロイ時やビルド時に明示的に実行する）"""
+    os.makedirs(dest_dir, exist_ok=True)
+    saved = []
+    for filename, url in FONT_FILES.items():
+        path = os.path.join(dest_dir, filename)
+        if os.path.isfile(path):
+            saved.append(path)
+            continue
+        tmp_path = path + ".part"
+        try:
+            with urllib.request.urlopen(url, timeout=timeout) as response, open(tmp_path, 'wb') as f:
+                while True:
+                    block = response.read(1 << 20)
+                    if not block:
+                        break
+                    f.write(block)
+            os.replace(tmp_path, path)
+            saved.append(path)
+        except Exception as e:
+            logger.warning("フォントを取得できませんでした: %s (%s)", url, e)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    return saved
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="日本語フォントの確認・事前取得")
+    parser.add_argument("--download", action="store_true", help="フォントをダウンロードする")
+    parser.add_argument("--dir", default=os.environ.get(FONT_DIR_ENV, BUNDLED_FONT_DIR), help="保存先ディレクトリ")
+    parser.add_argument("--timeout", type=float, default=DOWNLOAD_TIMEOUT, help="1ファイルあたりのタイムアウト秒数")
+    args = parser.parse_args(argv)
+    if args.download:
+        for path in download_fonts(args.dir, args.timeout):
+            print(path)
+    else:
+        for path in find_font_files():
+            print(path)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,113 @@
+"""正規化済み取引の永続ストア（SQLite、日付インデックス付き）
+
+過去の明細を毎回Excelから読み直さずに済むよう、取引を1つのSQLiteファイルに蓄積する。
+追加時は (日付, 金額, 摘要) のハッシュとファイル内での出現順をキーにして、
+保存済みの取引を無視する。表示時は必要な期間だけを日付インデックスで取り出す。
+"""
+import contextlib
+import datetime
+import os
+import sqlite3
+import threading
+
+import numpy as np
+import pandas as pd
+
+from expense_core import TRANSACTION_COLUMNS, transaction_keys
+
+STORE_PATH_ENV = "EXPENSE_STORE_PATH"
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS transactions (
+    row_hash INTEGER NOT NULL,
+    occurrence INTEGER NOT NULL,
+    date TEXT NOT NULL,
+    amount REAL NOT NULL,
+    description TEXT NOT NULL DEFAULT '',
+    source TEXT NOT NULL DEFAULT '',
+    added_at TEXT NOT NULL,
+    PRIMARY KEY (row_hash, occurrence)
+);
+CREATE INDEX IF NOT EXISTS idx_transactions_date ON transactions (date);
+"""
+
+def _to_text(value):
+    # 日付（date/datetime/Timestamp/文字列）をストアの文字列形式にする
+    return pd.Timestamp(value).strftime(DATE_FORMAT)
+
+class TransactionStore:
+    """取引の追加（未保存分のみ）と期間指定の取り出しを行う"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+
+    @contextlib.contextmanager
+    def _connect(self):
+        # Streamlitは複数スレッドから呼ぶため、操作ごとに接続を開いて閉じる
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def append(self, transactions):
+        """未保存の取引だけを追加し、追加した件数を返す"""
+        if len(transactions) == 0:
+            return 0
+        keys = transaction_keys(transactions)
+        rows = zip(
+            keys['key'].to_numpy().view(np.int64).tolist(),
+            keys['occurrence'].tolist(),
+            transactions['日付'].dt.strftime(DATE_FORMAT).tolist(),
+            transactions['金額'].astype('float64').tolist(),
+            transactions['摘要'].tolist(),
+            transactions['ファイル'].tolist(),
+        )
+        added_at = datetime.datetime.now().strftime(DATE_FORMAT)
+        with self._lock, self._connect() as conn:
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO transactions "
+                "(row_hash, occurrence, date, amount, description, source, added_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (row + (added_at,) for row in rows),
+            )
+            return conn.total_changes - before
+
+    def query(self, start=None, end=None):
+        """start以上end未満の取引を日付順に返す（どちらも省略可）"""
+        conditions, params = [], []
+        if start is not None:
+            conditions.append("date >= ?")
+            params.append(_to_text(start))
+        if end is not None:
+            conditions.append("date < ?")
+            params.append(_to_text(end))
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        with self._connect() as conn:
+            df = pd.read_sql_query(
+                f"SELECT date, amount, description, source FROM transactions {where} ORDER BY date",
+                conn, params=params,
+            )
+        df.columns = TRANSACTION_COLUMNS
+        df['日付'] = pd.to_datetime(df['日付'], format=DATE_FORMAT)
+        return df
+
+    def date_bounds(self):
+        """保存済み取引の最初と最後の日時（空ならNone）"""
+        with self._connect() as conn:
+            first, last = conn.execute("SELECT MIN(date), MAX(date) FROM transactions").fetchone()
+        if first is None:
+            return None
+        return pd.Timestamp(first), pd.Timestamp(last)
+
+    def count(self):
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM transactions").fetchone()[0]
@@ -0,0 +1,125 @@
+"""処理段階ごとの時間・メモリの計測と、1回分の実行のプロファイル
+
+計測結果は段階ごとに1行のJSONとしてログ（ロガー名 expense_trace）に出力する。
+本番のログから、遅いファイルがどの段階（Excelの解析・ヘッダー検出・列の検出・グラフ描画など）で
+時間を使ったかを再現なしで確認できる。
+"""
+import contextlib
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# このモジュールを最初に読み込んだ時刻（Streamlitのスクリプト再実行ではリセットされない）
+PROCESS_STARTED = time.perf_counter()
+_first_render = {}
+_first_render_lock = threading.Lock()
+
+DEBUG_ENV = "EXPENSE_DEBUG"
+# Pythonのメモリ確保を追跡する（遅くなるため既定では無効）
+TRACE_MEMORY_ENV = "EXPENSE_TRACE_MEMORY"
+PROFILE_ROWS = 30
+
+def _rss_mb():
+    """現在の常駐メモリ（MB）。/procがない環境では最大常駐メモリで代用する"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return float('nan')
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOSはバイト、Linuxはキロバイト単位
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+def configure_logging(stream=None):
+    """計測ログ（1行1JSON）を標準エラー出力へ出す（何度呼んでもハンドラーは1つ）"""
+    if not logger.handlers:
+        handler = logging.StreamHandler(stream)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+
+def debug_enabled():
+    return os.environ.get(DEBUG_ENV, '').lower() in ('1', 'true', 'yes')
+
+class StageTimer:
+    """1回の実行（リクエスト）の段階ごとの秒数・メモリを記録し、JSONのログ行として出力する"""
+
+    def __init__(self, request_id=None, trace_memory=None):
+        self.request_id = request_id or uuid.uuid4().hex[:12]
+        self.records = []
+        self.started_at = time.time()
+        self._started = time.perf_counter()
+        if trace_memory is None:
+            trace_memory = os.environ.get(TRACE_MEMORY_ENV, '').lower() in ('1', 'true', 'yes')
+        self.trace_memory = trace_memory and not tracemalloc.is_tracing()
+        if self.trace_memory:
+            tracemalloc.start()
+
+    @contextlib.contextmanager
+    def stage(self, name, **fields):
+        """with文の範囲を1つの段階として計測する（fieldsはログに付ける追加情報）"""
+        rss_before = _rss_mb()
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        started = time.perf_counter()
+        try:
+            yield fields
+        finally:
+            seconds = time.perf_counter() - started
+            record = {'stage': name, 'seconds': round(seconds, 6)}
+            rss = _rss_mb()
+            record['rss_mb'] = round(rss, 1)
+            record['rss_delta_mb'] = round(rss - rss_before, 1)
+            if self.trace_memory:
+                record['py_peak_mb'] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 1)
+            record.update(fields)
+            self._emit(record)
+
+    def add(self, name, seconds, **fields):
+        """別の場所（ワーカープロセスなど）で計測した時間を段階として追加する"""
+        self._emit({'stage': name, 'seconds': round(seconds, 6), **fields})
+
+    def _emit(self, record):
+        self.records.append(record)
+        logger.info(json.dumps({'event': 'stage', 'request': self.request_id, **record}, ensure_ascii=False, default=str))
+
+    def finish(self, **fields):
+        """実行全体の時間をログに出力し、計測を終える"""
+        total = time.perf_counter() - self._started
+        summary = {'event': 'request', 'request': self.request_id, 'seconds': round(total, 6), 'stages': len(self.records), **fields}
+        if self.trace_memory:
+            summary['py_peak_mb'] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 1)
+            tracemalloc.stop()
+        logger.info(json.dumps(summary, ensure_ascii=False, default=str))
+        return summary
+
+def record_first_render():
+    """プロセスで最初のグラフ表示までの時間（コールドスタート）を1回だけ記録してログに出力する"""
+    with _first_render_lock:
+        if 'seconds' not in _first_render:
+            _first_render['seconds'] = time.perf_counter() - PROCESS_STARTED
+            logger.info(json.dumps({'event': 'cold_start', 'seconds': round(_first_render['seconds'], 6)}))
+        return _first_render['seconds']
+
+def profile_call(func, *args, rows=PROFILE_ROWS, **kwargs):
+    """funcをcProfile付きで実行し、(戻り値, 累積時間の上位rows件の表の文字列) を返す"""
+    profiler = cProfile.Profile()
+    value = profiler.runcall(func, *args, **kwargs)
+    out = io.StringIO()
+    pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(rows)
+    return value, out.getvalue()